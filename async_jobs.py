@@ -0,0 +1,612 @@
+"""
+Asyncio job runner for PostgreSQL Database Manager
+
+Runs many backups, restores and connection tests from one event loop
+instead of one thread per job. pg_dump and pg_restore are started with
+asyncio.create_subprocess_exec and their progress output, compressor pipes
+and timeouts are all handled on the loop, so fifty running dumps cost
+fifty sets of pipes, not fifty threads:
+
+    from async_jobs import AsyncJobRunner
+    runner = AsyncJobRunner(engine, max_jobs=32, max_per_server=4)
+    backup = runner.backup("postgresql://...@db1/sales", "/backups/sales.dump", timeout=3600)
+    runner.restore("postgresql://...@db2/sales_copy", "/backups/old_sales.dump")
+    runner.test("postgresql://...@db3/shop")
+    runner.wait()
+    print(backup.status, backup.result["file_path"])
+
+The engine's own work between tool runs (census, checksums, repository
+storage, history) is short and blocking, and runs on a small shared thread
+pool (see DatabaseEngine.backup_steps and run_steps). Every runner shares
+one event loop in a background thread, started on first use.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+from db_engine import (
+    DEFAULT_MAX_JOBS,
+    DEFAULT_QUEUE_PER_HOST,
+    PIPE_CHUNK_BYTES,
+    JobControl,
+    OperationCancelled,
+    connection_database,
+    connection_host,
+    decompressor_command,
+    piped_result,
+    process_group_options,
+    terminate_process_group,
+)
+
+# Threads for the blocking work between tool runs, shared by every job
+STEP_WORKERS = 16
+# A longer stderr line than this is skipped rather than buffered
+STDERR_LINE_LIMIT = 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+TIMEOUT_ERROR = "Stopped: the job ran out of time"
+
+_loop = None
+_executor = None
+_lock = threading.Lock()
+
+
+def _install_child_watcher(loop):
+    """Make the loop reap its tools without a thread or signal per process where it can"""
+    if os.name == "nt" or sys.version_info >= (3, 12):
+        # Windows waits on process handles; 3.12+ uses pidfds by itself
+        return
+    if sys.version_info >= (3, 9) and hasattr(os, "pidfd_open"):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+        except OSError:
+            pass  # Kernel before 5.3
+        else:
+            watcher = asyncio.PidfdChildWatcher()
+            watcher.attach_loop(loop)
+            asyncio.set_child_watcher(watcher)
+            return
+    if sys.version_info < (3, 8) and threading.current_thread() is threading.main_thread():
+        # Python 3.7 reaps through a SIGCHLD handler, which only the main
+        # thread can install, for a loop that may run in any thread
+        watcher = asyncio.SafeChildWatcher()
+        watcher.attach_loop(loop)
+        asyncio.set_child_watcher(watcher)
+
+
+def event_loop():
+    """The shared event loop, running in a background thread from the first call
+
+    Call this from the main thread first on Python 3.7, which can only set
+    up subprocess support there.
+    """
+    global _loop
+    with _lock:
+        if _loop is None:
+            # Python 3.7's default Windows loop can't start subprocesses
+            loop = asyncio.ProactorEventLoop() if os.name == "nt" else asyncio.new_event_loop()
+            _install_child_watcher(loop)
+            threading.Thread(
+                target=loop.run_forever, name="pgdm-event-loop", daemon=True
+            ).start()
+            _loop = loop
+        return _loop
+
+
+def step_executor():
+    """The shared thread pool for the blocking work between tool runs"""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(STEP_WORKERS, thread_name_prefix="pgdm-step")
+        return _executor
+
+
+def submit_steps(steps, timeout=None):
+    """Drive an operation generator on the shared loop from any thread
+
+    Returns a concurrent.futures.Future of the operation's result.
+    """
+    return asyncio.run_coroutine_threadsafe(
+        drive(steps, step_executor(), timeout), event_loop()
+    )
+
+
+def call_later(seconds, callback):
+    """Run callback on the shared loop after seconds; callable from any thread"""
+    loop = event_loop()
+    loop.call_soon_threadsafe(loop.call_later, seconds, callback)
+
+
+class ProcessHandle:
+    """Popen-like view of an asyncio subprocess
+
+    Lets JobControl and terminate_process_group stop it from any thread.
+    """
+
+    def __init__(self, process, loop):
+        self.process = process
+        self.loop = loop
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def poll(self):
+        return self.process.returncode
+
+    def terminate(self):
+        self.loop.call_soon_threadsafe(self._signal, "terminate")
+
+    def kill(self):
+        self.loop.call_soon_threadsafe(self._signal, "kill")
+
+    def _signal(self, method):
+        try:
+            getattr(self.process, method)()
+        except ProcessLookupError:
+            pass
+
+
+def _advance(send, value):
+    """One step of an operation generator: (finished, next ToolStep or result)"""
+    try:
+        return False, send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+def _write_hashed(output, hasher, data):
+    output.write(data)
+    hasher.update(data)
+
+
+async def _start(cmd, stdin, stdout):
+    return await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=stdin,
+        stdout=stdout,
+        stderr=subprocess.PIPE,
+        limit=STDERR_LINE_LIMIT,
+        **process_group_options()
+    )
+
+
+async def _stream_stderr(process, runner):
+    """Feed the tool's stderr to its StreamingProcess line by line; returns the exit code"""
+    while True:
+        try:
+            line = await process.stderr.readline()
+        except ValueError:
+            continue  # Over STDERR_LINE_LIMIT; the reader has dropped it
+        if not line:
+            break
+        runner.feed(line.decode(errors="replace").replace("\r\n", "\n"))
+    return await process.wait()
+
+
+async def _copy_hashed(stream, output, hasher, executor):
+    """Write a compressor's output to the file, checksumming it on the way"""
+    loop = asyncio.get_event_loop()
+    while True:
+        data = await stream.read(COPY_CHUNK_SIZE)
+        if not data:
+            return
+        # Hashing is CPU work; keep it off the loop
+        await loop.run_in_executor(executor, _write_hashed, output, hasher, data)
+
+
+async def _follow(checksummer, stopped, executor):
+    """Keep an OutputChecksummer up with the output until stopped is set"""
+    loop = asyncio.get_event_loop()
+    while True:
+        try:
+            await asyncio.wait_for(stopped.wait(), checksummer.poll_seconds)
+            return
+        except asyncio.TimeoutError:
+            pass
+        await loop.run_in_executor(executor, checksummer.catch_up)
+
+
+async def _pump(reader, writer, buffer, source):
+    """Move a source tool's output into the target tool's stdin
+
+    The target's write buffer is limited to the PipeBuffer's size, so
+    drain() holds the source back while the target is behind. If the
+    target stops reading, the source is stopped.
+    """
+    try:
+        while True:
+            data = await reader.read(PIPE_CHUNK_BYTES)
+            if not data:
+                break
+            transport = writer.transport
+            buffer.count(len(data), transport.get_write_buffer_size())
+            writer.write(data)
+            if transport.get_write_buffer_size() > transport.get_write_buffer_limits()[1]:
+                buffer.stalls += 1  # Past high, so drain() waits for the target
+            await writer.drain()
+        writer.close()
+    except (BrokenPipeError, ConnectionResetError):
+        buffer.abort()
+        terminate_process_group(source)
+
+
+async def run_tool_step(step, executor, timeout=None):
+    """Run a ToolStep on the event loop; returns (exit code, error output)
+
+    Does what ToolStep.run does with the loop in place of threads: the
+    tool's stderr, a compressor's output, a piped source tool's output and
+    a checksummer's polling are all served by the loop. A tool still
+    running after timeout seconds is stopped like a cancelled one and the
+    step fails.
+    """
+    loop = asyncio.get_event_loop()
+    runner = step.runner
+    pipe_fds = []
+    output = None
+    helper = None
+    helper_cmd = None
+    helper_tasks = []
+    process = handle = None
+    source = source_handle = source_tasks = None
+    follower = stop_following = None
+    try:
+        stdin = stdout = subprocess.DEVNULL
+        if step.compressor:
+            # tool | compressor > output_path
+            helper_cmd = step.compressor
+            read_fd, write_fd = os.pipe()
+            pipe_fds += [read_fd, write_fd]
+            output = open(step.output_path, "wb")
+            helper = await _start(
+                helper_cmd, read_fd, subprocess.PIPE if step.hasher else output
+            )
+            if step.hasher:
+                helper_tasks.append(
+                    loop.create_task(_copy_hashed(helper.stdout, output, step.hasher, executor))
+                )
+            stdout = write_fd
+        elif step.decompress:
+            # decompressor < dump | tool
+            helper_cmd = decompressor_command(step.decompress)
+            read_fd, write_fd = os.pipe()
+            pipe_fds += [read_fd, write_fd]
+            helper = await _start(helper_cmd, subprocess.DEVNULL, write_fd)
+            stdin = read_fd
+        elif step.source:
+            # source | tool, with the loop moving the data in between
+            source = await _start(step.source.cmd, subprocess.DEVNULL, subprocess.PIPE)
+            source_handle = step.source.process = ProcessHandle(source, loop)
+            if step.source.control:
+                step.source.control.attach(source_handle)
+            stdin = subprocess.PIPE
+        if helper:
+            helper_tasks.append(loop.create_task(helper.stderr.read()))
+        if step.follow:
+            stop_following = asyncio.Event()
+            follower = loop.create_task(_follow(step.follow, stop_following, executor))
+
+        process = await _start(runner.cmd, stdin, stdout)
+        # Only the tools may hold the pipe ends, or they never see EOF
+        for fd in pipe_fds:
+            os.close(fd)
+        pipe_fds = []
+        handle = runner.process = ProcessHandle(process, loop)
+        if runner.control:
+            runner.control.attach(handle)
+        if source:
+            # drain() waits once the buffer is past high, so leave room for a chunk
+            process.stdin.transport.set_write_buffer_limits(
+                high=max(step.buffer.max_bytes - PIPE_CHUNK_BYTES, 0)
+            )
+            source_tasks = [
+                loop.create_task(_pump(source.stdout, process.stdin, step.buffer, source_handle)),
+                loop.create_task(_stream_stderr(source, step.source)),
+            ]
+
+        timed_out = False
+        try:
+            returncode = await asyncio.wait_for(_stream_stderr(process, runner), timeout)
+        except asyncio.TimeoutError:
+            timed_out = True
+            for started in (handle, source_handle):
+                if started:
+                    terminate_process_group(started)
+            returncode = await process.wait()
+
+        if source:
+            pump, source_stream = source_tasks
+            if returncode == 0 and not timed_out:
+                # The target read everything; the source is just finishing
+                await pump
+            elif not pump.done():
+                # Nothing will read the rest of the source's output
+                step.buffer.abort()
+                pump.cancel()
+                terminate_process_group(source_handle)
+            source_code = await source_stream
+            if not timed_out:
+                return piped_result(step.source, source_code, returncode, step.buffer)
+
+        error = ""
+        if helper:
+            results = await asyncio.gather(*helper_tasks)
+            error = results[-1].decode(errors="replace").strip()
+            helper_code = await helper.wait()
+            if returncode == 0 and helper_code != 0:
+                return helper_code, error or f"{helper_cmd[0]} failed"
+        if timed_out:
+            return returncode or 1, TIMEOUT_ERROR
+        return returncode, error
+    except BaseException:
+        # Cancelled or failed halfway: don't leave tools running
+        for started in (handle, source_handle, helper and ProcessHandle(helper, loop)):
+            if started:
+                terminate_process_group(started)
+        raise
+    finally:
+        for fd in pipe_fds:
+            os.close(fd)
+        for task in source_tasks or ():
+            if not task.done():
+                task.cancel()
+        if source_handle and step.source.control:
+            step.source.control.detach(source_handle)
+        if follower:
+            stop_following.set()
+            await follower
+        for task in helper_tasks:
+            if not task.done():
+                task.cancel()
+        if output:
+            output.close()
+        if handle and runner.control:
+            runner.control.detach(handle)
+
+
+async def drive(steps, executor, timeout=None):
+    """Run an operation generator (see run_steps) with its tools on the loop
+
+    The operation's own code runs on executor between tool runs. timeout
+    limits the tool runs of the whole operation, in seconds.
+    """
+    loop = asyncio.get_event_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    send, value = steps.send, None
+    while True:
+        finished, step = await loop.run_in_executor(executor, _advance, send, value)
+        if finished:
+            return step
+        remaining = None if deadline is None else deadline - loop.time()
+        if remaining is not None and remaining <= 0:
+            send, value = steps.send, (1, TIMEOUT_ERROR)
+            continue
+        try:
+            send, value = steps.send, await run_tool_step(step, executor, remaining)
+        except asyncio.CancelledError:
+            # The tools are stopped; let the operation clean up as if cancelled
+            _advance(steps.throw, OperationCancelled("Cancelled"))
+            raise
+        except Exception as e:
+            send, value = steps.throw, e
+
+
+class AsyncJob:
+    """One job of an AsyncJobRunner and its outcome"""
+
+    DONE_STATUSES = ("success", "failed", "cancelled")
+
+    def __init__(self, job_id, kind, label, host, control):
+        self.id = job_id
+        self.kind = kind
+        self.label = label
+        self.host = host
+        self.control = control
+        self.status = "queued"
+        self.result = None
+        self.started = None
+        self.ended = None
+        self.future = None
+        self.task = None
+
+    @property
+    def done(self):
+        return self.status in self.DONE_STATUSES
+
+    def wait(self, timeout=None):
+        """The job's result once it's done; None on timeout"""
+        wait_futures([self.future], timeout)
+        return self.result
+
+
+class AsyncJobRunner:
+    """Runs backups, restores, clones and connection tests concurrently on the shared loop
+
+    At most max_jobs run at once, and at most max_per_server against one
+    server (host:port). Each server has its own semaphore, so jobs waiting
+    for a busy server don't hold up jobs for the others; a job waits for
+    its server's slot before taking one of the max_jobs. Every method can
+    be called from any thread; on_update(job) is called on the loop
+    whenever a job starts or finishes.
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_jobs=DEFAULT_MAX_JOBS,
+        max_per_server=DEFAULT_QUEUE_PER_HOST,
+        on_update=None,
+    ):
+        self.engine = engine
+        self.max_jobs = max_jobs
+        self.max_per_server = max_per_server
+        self.on_update = on_update
+        self.loop = event_loop()
+        self.executor = step_executor()
+        self.jobs = []
+        self.lock = threading.Lock()
+        self._next_id = 1
+        # Made on the loop, which asyncio primitives belong to before 3.10
+        self._slots = None
+        self._server_slots = {}
+
+    def backup(self, source_db, filepath, timeout=None, **options):
+        """Queue a backup (options as for DatabaseEngine.backup_steps)
+
+        timeout limits the time pg_dump may run, in seconds.
+        """
+        control = options.pop("control", None) or JobControl(
+            f"Backup of {connection_database(source_db)}"
+        )
+        return self.submit(
+            "backup",
+            connection_host(source_db),
+            lambda: drive(
+                self.engine.backup_steps(source_db, filepath, control=control, **options),
+                self.executor,
+                timeout,
+            ),
+            control,
+        )
+
+    def restore(self, target_db, dump_file, timeout=None, **options):
+        """Queue a restore (options as for DatabaseEngine.restore_steps)
+
+        timeout limits the time pg_restore may run, in seconds.
+        """
+        control = options.pop("control", None) or JobControl(
+            f"Restore into {connection_database(target_db)}"
+        )
+        return self.submit(
+            "restore",
+            connection_host(target_db),
+            lambda: drive(
+                self.engine.restore_steps(target_db, dump_file, control=control, **options),
+                self.executor,
+                timeout,
+            ),
+            control,
+        )
+
+    def clone(self, source_db, target_db, timeout=None, **options):
+        """Queue a clone (options as for DatabaseEngine.clone_steps)
+
+        The job counts against the target's server, which does the heavier
+        work. timeout limits the time the copy may run, in seconds.
+        """
+        control = options.pop("control", None) or JobControl(
+            f"Clone of {connection_database(source_db)} into {connection_database(target_db)}"
+        )
+        return self.submit(
+            "clone",
+            connection_host(target_db),
+            lambda: drive(
+                self.engine.clone_steps(source_db, target_db, control=control, **options),
+                self.executor,
+                timeout,
+            ),
+            control,
+        )
+
+    def test(self, conn_string, timeout=None):
+        """Queue a connection test (see DatabaseEngine.test_connection)"""
+        return self.submit(
+            "test",
+            connection_host(conn_string),
+            lambda: self.loop.run_in_executor(
+                self.executor, self.engine.test_connection, conn_string, timeout
+            ),
+            JobControl(f"Connection test of {connection_database(conn_string)}"),
+        )
+
+    def submit(self, kind, host, work, control):
+        """Queue work(), a coroutine factory returning a result dict, under host's limit"""
+        with self.lock:
+            job = AsyncJob(self._next_id, kind, control.label, host, control)
+            self._next_id += 1
+            self.jobs.append(job)
+        job.future = asyncio.run_coroutine_threadsafe(self._run(job, work), self.loop)
+        return job
+
+    def cancel(self, job):
+        """Cancel a job; a running one stops its tools and cleans up
+
+        Returns False if the job had already finished.
+        """
+        if job.done:
+            return False
+        job.control.cancel()
+        self.loop.call_soon_threadsafe(self._cancel_queued, job)
+        return True
+
+    def cancel_all(self):
+        """Cancel every job that hasn't finished; returns how many there were"""
+        with self.lock:
+            jobs = [job for job in self.jobs if not job.done]
+        for job in jobs:
+            self.cancel(job)
+        return len(jobs)
+
+    def counts(self):
+        """Number of jobs per status"""
+        counts = {}
+        with self.lock:
+            for job in self.jobs:
+                counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def wait(self, timeout=None):
+        """Block until every submitted job is done; returns False on timeout"""
+        with self.lock:
+            futures = [job.future for job in self.jobs]
+        return not wait_futures(futures, timeout).not_done
+
+    def _cancel_queued(self, job):
+        # On the loop, where jobs start, so a job can't start in between
+        if job.status == "queued" and job.task:
+            job.task.cancel()
+
+    async def _run(self, job, work):
+        job.task = asyncio.current_task()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_jobs)
+        server_slots = self._server_slots.setdefault(
+            job.host, asyncio.Semaphore(self.max_per_server)
+        )
+        try:
+            if job.control.cancelled:
+                # Cancelled before this task got going
+                raise asyncio.CancelledError()
+            async with server_slots, self._slots:
+                if job.control.cancelled:
+                    raise asyncio.CancelledError()
+                job.status = "running"
+                job.started = time.monotonic()
+                self._notify(job)
+                try:
+                    job.result = await work()
+                except asyncio.CancelledError:
+                    raise  # An Exception before Python 3.8
+                except Exception as e:
+                    job.result = {"success": False, "error": f"Unexpected error: {e}"}
+        except asyncio.CancelledError:
+            if job.result is None:
+                job.result = {"success": False, "cancelled": True, "error": "Cancelled"}
+        job.ended = time.monotonic()
+        if job.result["success"]:
+            job.status = "success"
+        elif job.result.get("cancelled"):
+            job.status = "cancelled"
+        else:
+            job.status = "failed"
+        self._notify(job)
+        return job.result
+
+    def _notify(self, job):
+        if self.on_update:
+            self.on_update(job)
@@ -0,0 +1,494 @@
+"""
+Deduplicating backup repository for PostgreSQL Database Manager
+
+Stores directory-format dumps as content-addressed chunks, so table data
+that didn't change since the last backup is written only once:
+
+    repository/
+        config.json                 format version and chunking parameters
+        chunks/ab/ab12...ef         zlib-compressed chunk, named by its SHA-256
+        manifests/<backup>.json     the files of one backup as lists of chunks
+        pending/<backup>            marks a backup that is still being stored
+        staging/                    dumps waiting to be stored, and checkouts
+
+Files are cut into chunks at line ends chosen by a hash of the line
+itself, not at fixed offsets, so a row inserted or updated in the middle of
+a table's COPY data only changes the chunk around it instead of shifting
+every chunk after it. Dumps should be written uncompressed (pg_dump -Z 0);
+the repository compresses each chunk once.
+
+    from backup_repository import BackupRepository
+    repo = BackupRepository("/backups/repository").init()
+    manifest = repo.store("/backups/repository/staging/sales.dir", "sales_20250814")
+    repo.checkout("sales_20250814", "/tmp/sales.dir")
+    repo.delete("sales_20250814")
+    repo.gc()
+
+Deleting a backup only removes its manifest; gc() then removes the chunks
+no manifest refers to any more.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import accumulate, chain, compress, count, repeat
+from operator import add, lt, mul
+
+REPOSITORY_VERSION = 1
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_AVG_SIZE = 1024 * 1024
+CHUNK_MAX_SIZE = 4 * 1024 * 1024
+READ_SIZE = 8 * 1024 * 1024
+DEFAULT_COMPRESSION_LEVEL = 3
+DEFAULT_STORE_WORKERS = 4
+
+# Unreferenced chunks younger than this survive garbage collection, in case
+# a backup that is being stored right now is about to refer to them
+GC_GRACE_SECONDS = 3600
+GC_LOCK_STALE_SECONDS = 6 * 3600
+GC_LOCK_POLL_SECONDS = 1.0
+
+
+class RepositoryError(RuntimeError):
+    """A repository that is missing, damaged or asked for a backup it doesn't have"""
+
+
+def iter_chunks(
+    f,
+    min_size=CHUNK_MIN_SIZE,
+    avg_size=CHUNK_AVG_SIZE,
+    max_size=CHUNK_MAX_SIZE,
+    read_size=READ_SIZE,
+):
+    """Split a binary stream into content-defined chunks
+
+    A chunk may end after a line whose CRC-32 falls below a threshold
+    proportional to the line's length, so on average a chunk ends every
+    avg_size bytes past min_size whatever the row width. Without such a
+    line (e.g. binary data) a chunk is cut at max_size.
+    """
+    # crc32 is uniform over 32 bits: P(line is a cut point) = len(line) / span
+    factor = (1 << 32) // max(1, avg_size - min_size)
+    buf = b""
+    start = 0  # where the current chunk begins in buf
+    checked = 0  # line ends before this offset have been looked at
+    eof = False
+    while not eof:
+        block = f.read(read_size)
+        eof = not block
+        buf += block
+        end = len(buf) if eof else buf.rfind(b"\n", checked) + 1
+        if end > checked:
+            # Splitting, hashing and comparing run over the whole block in
+            # C; Python only visits the rare lines that qualify as cut points
+            lines = buf[checked:end].split(b"\n")
+            if not eof:
+                lines.pop()  # empty remainder after the final newline
+            sizes = map(add, map(len, lines), repeat(1))
+            ends = list(accumulate(chain((checked,), sizes)))
+            thresholds = map(mul, map(len, lines), repeat(factor))
+            flags = map(lt, map(zlib.crc32, lines), thresholds)
+            for index in compress(count(1), flags):
+                cut = min(ends[index], len(buf))
+                while cut - start > max_size:
+                    yield buf[start : start + max_size]
+                    start += max_size
+                if cut - start >= min_size:
+                    yield buf[start:cut]
+                    start = cut
+            checked = end
+        while len(buf) - start >= max_size:
+            yield buf[start : start + max_size]
+            start += max_size
+        checked = max(checked, start)
+        buf = buf[start:]
+        checked -= start
+        start = 0
+    if buf:
+        yield buf
+
+
+def manifest_location(path):
+    """(repository path, backup id) if path is a backup manifest, else None"""
+    path = os.path.abspath(path)
+    manifests_dir, name = os.path.split(path)
+    root = os.path.dirname(manifests_dir)
+    if (
+        name.endswith(".json")
+        and os.path.basename(manifests_dir) == "manifests"
+        and os.path.isfile(os.path.join(root, "config.json"))
+    ):
+        return root, name[: -len(".json")]
+    return None
+
+
+def _write_atomic(path, data):
+    """Write bytes to path so readers never see a partial file"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class BackupRepository:
+    """Content-addressed, chunked storage for directory-format dumps"""
+
+    def __init__(self, path, compression_level=DEFAULT_COMPRESSION_LEVEL, clock=time.time):
+        self.path = os.path.abspath(path)
+        self.compression_level = compression_level
+        self.clock = clock
+        self.chunks_dir = os.path.join(self.path, "chunks")
+        self.manifests_dir = os.path.join(self.path, "manifests")
+        self.pending_dir = os.path.join(self.path, "pending")
+        self.staging_dir = os.path.join(self.path, "staging")
+        self.gc_lock = os.path.join(self.path, "gc.lock")
+        self.lock = threading.Lock()
+        self._reserved = set()
+
+    @staticmethod
+    def is_repository(path):
+        return os.path.isfile(os.path.join(path, "config.json"))
+
+    def init(self):
+        """Create the repository if it doesn't exist; returns self"""
+        for directory in (self.chunks_dir, self.manifests_dir, self.pending_dir, self.staging_dir):
+            os.makedirs(directory, exist_ok=True)
+        config_path = os.path.join(self.path, "config.json")
+        if os.path.exists(config_path):
+            self._check_config(config_path)
+        else:
+            config = {
+                "version": REPOSITORY_VERSION,
+                "hash": "sha256",
+                "compression": "zlib",
+                "chunk_min_size": CHUNK_MIN_SIZE,
+                "chunk_avg_size": CHUNK_AVG_SIZE,
+                "chunk_max_size": CHUNK_MAX_SIZE,
+            }
+            _write_atomic(config_path, json.dumps(config, indent=2).encode("utf-8"))
+        return self
+
+    def open(self):
+        """Check that the repository exists and is readable; returns self"""
+        config_path = os.path.join(self.path, "config.json")
+        if not os.path.exists(config_path):
+            raise RepositoryError(f"{self.path} is not a backup repository")
+        self._check_config(config_path)
+        return self
+
+    def _check_config(self, config_path):
+        try:
+            with open(config_path, "r") as f:
+                config = json.load(f)
+        except (OSError, ValueError) as e:
+            raise RepositoryError(f"Can't read {config_path}: {e}")
+        if config.get("version") != REPOSITORY_VERSION:
+            raise RepositoryError(
+                f"{self.path} uses repository format {config.get('version')}, "
+                f"this version reads format {REPOSITORY_VERSION}"
+            )
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def manifest_path(self, backup_id):
+        return os.path.join(self.manifests_dir, f"{backup_id}.json")
+
+    def has_backup(self, backup_id):
+        return os.path.exists(self.manifest_path(backup_id))
+
+    def reserve(self, name):
+        """Unique staging folder for a dump named after name, like 'sales_20250814.dir'
+
+        The backup id is the folder name without '.dir'.
+        """
+        with self.lock:
+            suffix = 1
+            while True:
+                backup_id = name if suffix == 1 else f"{name}_{suffix}"
+                path = os.path.join(self.staging_dir, f"{backup_id}.dir")
+                if (
+                    backup_id not in self._reserved
+                    and not self.has_backup(backup_id)
+                    and not os.path.exists(path)
+                ):
+                    self._reserved.add(backup_id)
+                    return path
+                suffix += 1
+
+    def release(self, staging_path):
+        """Delete a folder from reserve() or checkout() and free its name"""
+        shutil.rmtree(staging_path, ignore_errors=True)
+        name = os.path.basename(os.path.normpath(staging_path))
+        with self.lock:
+            self._reserved.discard(name[: -len(".dir")])
+
+    def _store_chunk(self, data):
+        """Write one chunk unless the repository has it; returns (digest, bytes added)"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            try:
+                # A fresh mtime keeps gc() from collecting a chunk this
+                # backup is about to refer to again
+                os.utime(path)
+                return digest, 0
+            except OSError:
+                pass
+        compressed = zlib.compress(data, self.compression_level)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, compressed)
+        return digest, len(compressed)
+
+    def _store_file(self, path):
+        chunks = []
+        chunk_sizes = []
+        size = 0
+        added = 0
+        new_chunks = 0
+        with open(path, "rb") as f:
+            for data in iter_chunks(f):
+                digest, written = self._store_chunk(data)
+                chunks.append(digest)
+                chunk_sizes.append(len(data))
+                size += len(data)
+                if written:
+                    added += written
+                    new_chunks += 1
+        return {"size": size, "chunks": chunks, "chunk_sizes": chunk_sizes}, added, new_chunks
+
+    def _wait_for_gc(self):
+        """Block while a garbage collection is deleting chunks"""
+        while os.path.exists(self.gc_lock):
+            try:
+                if self.clock() - os.path.getmtime(self.gc_lock) > GC_LOCK_STALE_SECONDS:
+                    return
+            except OSError:
+                return
+            time.sleep(GC_LOCK_POLL_SECONDS)
+
+    def store(self, dump_dir, backup_id=None, metadata=None, workers=DEFAULT_STORE_WORKERS):
+        """Add a directory-format dump as a backup and return its manifest
+
+        The manifest records, per file, its size and its chunks' digests and
+        sizes, plus "logical_bytes" (the dump's size), "added_bytes" and
+        "new_chunks" (what this backup actually added to the repository).
+        """
+        backup_id = backup_id or os.path.basename(os.path.normpath(dump_dir))
+        if backup_id.endswith(".dir"):
+            backup_id = backup_id[: -len(".dir")]
+        if self.has_backup(backup_id):
+            raise RepositoryError(f"The repository already has a backup '{backup_id}'")
+        if not os.path.isfile(os.path.join(dump_dir, "toc.dat")):
+            raise RepositoryError(f"{dump_dir} is not a directory-format dump")
+
+        started = time.perf_counter()
+        marker = os.path.join(self.pending_dir, backup_id)
+        with open(marker, "w") as f:
+            f.write(str(os.getpid()))
+        try:
+            self._wait_for_gc()
+            names = sorted(
+                (entry.name for entry in os.scandir(dump_dir) if entry.is_file()),
+                key=lambda name: -os.path.getsize(os.path.join(dump_dir, name)),
+            )
+            # zlib and hashlib release the GIL on large buffers, so big
+            # table files compress side by side
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                results = list(
+                    pool.map(
+                        lambda name: self._store_file(os.path.join(dump_dir, name)),
+                        names,
+                    )
+                )
+            files = {}
+            added = 0
+            new_chunks = 0
+            for name, (entry, file_added, file_new) in zip(names, results):
+                files[name] = entry
+                added += file_added
+                new_chunks += file_new
+
+            manifest = {
+                "id": backup_id,
+                "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "metadata": metadata or {},
+                "logical_bytes": sum(entry["size"] for entry in files.values()),
+                "added_bytes": added,
+                "chunks": sum(len(entry["chunks"]) for entry in files.values()),
+                "new_chunks": new_chunks,
+                "seconds": round(time.perf_counter() - started, 3),
+                "files": files,
+            }
+            _write_atomic(
+                self.manifest_path(backup_id), json.dumps(manifest).encode("utf-8")
+            )
+        finally:
+            os.remove(marker)
+            with self.lock:
+                self._reserved.discard(backup_id)
+        return manifest
+
+    def load_manifest(self, backup_id):
+        try:
+            with open(self.manifest_path(backup_id), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise RepositoryError(f"No backup '{backup_id}' in {self.path}")
+        except ValueError as e:
+            raise RepositoryError(f"Backup '{backup_id}' has a damaged manifest: {e}")
+
+    def backups(self):
+        """Manifests without their chunk lists, oldest first"""
+        found = []
+        for name in os.listdir(self.manifests_dir):
+            if not name.endswith(".json"):
+                continue
+            try:
+                manifest = self.load_manifest(name[: -len(".json")])
+            except RepositoryError:
+                continue
+            manifest["files"] = len(manifest["files"])
+            found.append(manifest)
+        return sorted(found, key=lambda manifest: (manifest["created"], manifest["id"]))
+
+    def read_chunk(self, digest):
+        """Decompressed contents of a chunk, checked against its digest"""
+        try:
+            with open(self.chunk_path(digest), "rb") as f:
+                data = zlib.decompress(f.read())
+        except FileNotFoundError:
+            raise RepositoryError(f"Chunk {digest} is missing")
+        except zlib.error as e:
+            raise RepositoryError(f"Chunk {digest} is damaged: {e}")
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise RepositoryError(f"Chunk {digest} is damaged: checksum mismatch")
+        return data
+
+    def checkout(self, backup_id, target_dir=None, files=None):
+        """Rebuild a backup as a directory-format dump and return its path
+
+        Without target_dir it goes to a new folder under staging/; files
+        limits the checkout to some of the dump's files (e.g. ["toc.dat"]).
+        """
+        manifest = self.load_manifest(backup_id)
+        if target_dir is None:
+            target_dir = self.reserve(f"{backup_id}_checkout")
+            with self.lock:
+                self._reserved.discard(os.path.basename(target_dir)[: -len(".dir")])
+        os.makedirs(target_dir, exist_ok=True)
+        try:
+            for name, entry in manifest["files"].items():
+                if files is not None and name not in files:
+                    continue
+                with open(os.path.join(target_dir, name), "wb") as f:
+                    for digest in entry["chunks"]:
+                        f.write(self.read_chunk(digest))
+        except Exception:
+            shutil.rmtree(target_dir, ignore_errors=True)
+            raise
+        return target_dir
+
+    def verify(self, backup_id, read_data=True):
+        """Problems found with a backup's chunks (empty if it is intact)
+
+        With read_data every chunk is decompressed and checksummed;
+        otherwise only its presence is checked.
+        """
+        manifest = self.load_manifest(backup_id)
+        problems = []
+        checked = set()
+        for entry in manifest["files"].values():
+            for digest in entry["chunks"]:
+                if digest in checked:
+                    continue
+                checked.add(digest)
+                try:
+                    if read_data:
+                        self.read_chunk(digest)
+                    elif not os.path.exists(self.chunk_path(digest)):
+                        raise RepositoryError(f"Chunk {digest} is missing")
+                except RepositoryError as e:
+                    problems.append(str(e))
+        return problems
+
+    def delete(self, backup_id):
+        """Forget a backup; its chunks are freed by the next gc()"""
+        try:
+            os.remove(self.manifest_path(backup_id))
+        except FileNotFoundError:
+            raise RepositoryError(f"No backup '{backup_id}' in {self.path}")
+
+    def referenced_chunks(self):
+        """Digests of every chunk some backup refers to"""
+        referenced = set()
+        for name in os.listdir(self.manifests_dir):
+            if name.endswith(".json"):
+                manifest = self.load_manifest(name[: -len(".json")])
+                for entry in manifest["files"].values():
+                    referenced.update(entry["chunks"])
+        return referenced
+
+    def gc(self, dry_run=False):
+        """Delete chunks no backup refers to; returns counts and bytes freed"""
+        try:
+            fd = os.open(self.gc_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise RepositoryError("Another garbage collection is running")
+        os.close(fd)
+        try:
+            # Stores that started before the lock was taken are protected by
+            # their pending marker; later ones wait for the lock to go
+            cutoff = self.clock() - GC_GRACE_SECONDS
+            for name in os.listdir(self.pending_dir):
+                try:
+                    cutoff = min(cutoff, os.path.getmtime(os.path.join(self.pending_dir, name)))
+                except OSError:
+                    pass
+            referenced = self.referenced_chunks()
+
+            result = {"deleted_chunks": 0, "freed_bytes": 0, "kept_chunks": 0, "young_chunks": 0}
+            for prefix in os.listdir(self.chunks_dir):
+                prefix_dir = os.path.join(self.chunks_dir, prefix)
+                for entry in os.scandir(prefix_dir):
+                    if entry.name.endswith(".tmp"):
+                        continue
+                    if entry.name in referenced:
+                        result["kept_chunks"] += 1
+                        continue
+                    stat = entry.stat()
+                    if stat.st_mtime >= cutoff:
+                        result["young_chunks"] += 1
+                        continue
+                    if not dry_run:
+                        os.remove(entry.path)
+                    result["deleted_chunks"] += 1
+                    result["freed_bytes"] += stat.st_size
+            return result
+        finally:
+            os.remove(self.gc_lock)
+
+    def stats(self):
+        """Totals over all backups: logical size, bytes on disk and the ratio"""
+        backups = self.backups()
+        stored = 0
+        chunks = 0
+        for prefix in os.listdir(self.chunks_dir):
+            for entry in os.scandir(os.path.join(self.chunks_dir, prefix)):
+                if not entry.name.endswith(".tmp"):
+                    stored += entry.stat().st_size
+                    chunks += 1
+        logical = sum(manifest["logical_bytes"] for manifest in backups)
+        return {
+            "backups": len(backups),
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            "chunks": chunks,
+            "ratio": logical / stored if stored else 0.0,
+        }
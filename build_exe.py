@@ -85,13 +85,8 @@ def build_executable():
         "--exclude-module=pydoc",  # Exclude documentation
         "--exclude-module=email",  # Exclude email module (not used)
         "--exclude-module=xml",  # Exclude XML modules (not used)
-        "--exclude-module=urllib",  # Exclude urllib (not used)
         "--exclude-module=http",  # Exclude http modules (not used)
-        "--exclude-module=ssl",  # Exclude SSL (not used for local DB ops)
-        "--exclude-module=socket",  # Exclude socket (not used)
-        "--exclude-module=select",  # Exclude select (not used)
         "--exclude-module=multiprocessing",  # Exclude multiprocessing
-        "--exclude-module=concurrent",  # Exclude concurrent.futures
     ]
 
     # Platform-specific options
@@ -147,14 +142,7 @@ def build_executable():
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            text=True, (platform-specific extension)
-            plat = get_platform_info()
-            if plat['is_windows']:
-                exe_name = "PostgreSQL_Database_Manager.exe"
-            else:
-                exe_name = "PostgreSQL_Database_Manager"
-
-            exe_path = os.path.join("dist", exe_name
+            text=True,
             universal_newlines=True,
         )
 
@@ -178,8 +166,13 @@ def build_executable():
             print("✅ Build completed successfully!")
             print("📁 Executable created in 'dist' folder")
 
-            # Check if executable was created
-            exe_path = os.path.join("dist", "PostgreSQL_Database_Manager.exe")
+            # Check if executable was created (platform-specific extension)
+            if plat['is_windows']:
+                exe_name = "PostgreSQL_Database_Manager.exe"
+            else:
+                exe_name = "PostgreSQL_Database_Manager"
+
+            exe_path = os.path.join("dist", exe_name)
             if os.path.exists(exe_path):
                 file_size_mb = os.path.getsize(exe_path) / (1024 * 1024)
                 print(f"🎯 Executable location: {os.path.abspath(exe_path)}")
@@ -213,32 +206,13 @@ def build_executable():
         return False
 
 
-def cleanlat = get_platform_info()
-        print("\n🎉 Optimized build process completed successfully!")
-        print("💡 You can now run the executable from the 'dist' folder")
-
-        # Ask if user wants to clean up
-        clean_up = input("\n🧹 Do you want to clean up build files? (y/n): ").lower()
-        if clean_up in ["y", "yes"]:
-            clean_build_files()
-
-        print("\n📋 Summary:")
-        if plat['is_windows']:
-            exe_name = "PostgreSQL_Database_Manager.exe"
-            print(f"- Executable: dist/{exe_name}")
-            print("- Runs with administrator privileges")
-            print("- Double-click to run (will prompt for admin access)")
-        elif plat['is_mac']:
-            exe_name = "PostgreSQL_Database_Manager"
-            print(f"- Executable: dist/{exe_name}")
-            print("- Run with: sudo ./dist/PostgreSQL_Database_Manager")
-            print("- Or grant permissions: chmod +x ./dist/PostgreSQL_Database_Manager")
-        else:
-            exe_name = "PostgreSQL_Database_Manager"
-            print(f"- Executable: dist/{exe_name}")
-            print("- Run with: sudo ./dist/PostgreSQL_Database_Manager")
-
-        print("- Optimized and compressed for smaller file size
+def clean_build_files():
+    """Remove PyInstaller's build folder and spec file"""
+    if os.path.exists("build"):
+        shutil.rmtree("build", ignore_errors=True)
+        print("✅ Removed build folder")
+    if os.path.exists("PostgreSQL_Database_Manager.spec"):
+        os.remove("PostgreSQL_Database_Manager.spec")
         print("✅ Removed spec file")
 
 
@@ -256,6 +230,7 @@ def main():
         return
 
     # Build the executable
+    plat = get_platform_info()
     if build_executable():
         print("\n🎉 Optimized build process completed successfully!")
         print("💡 You can now run the executable from the 'dist' folder")
@@ -266,10 +241,22 @@ def main():
             clean_build_files()
 
         print("\n📋 Summary:")
-        print("- Executable: dist/PostgreSQL_Database_Manager.exe")
+        if plat['is_windows']:
+            exe_name = "PostgreSQL_Database_Manager.exe"
+            print(f"- Executable: dist/{exe_name}")
+            print("- Runs with administrator privileges")
+            print("- Double-click to run (will prompt for admin access)")
+        elif plat['is_mac']:
+            exe_name = "PostgreSQL_Database_Manager"
+            print(f"- Executable: dist/{exe_name}")
+            print("- Run with: sudo ./dist/PostgreSQL_Database_Manager")
+            print("- Or grant permissions: chmod +x ./dist/PostgreSQL_Database_Manager")
+        else:
+            exe_name = "PostgreSQL_Database_Manager"
+            print(f"- Executable: dist/{exe_name}")
+            print("- Run with: sudo ./dist/PostgreSQL_Database_Manager")
+
         print("- Optimized and compressed for smaller file size")
-        print("- Runs with administrator privileges")
-        print("- Double-click to run (will prompt for admin access)")
         print("- No Python installation required on target machines")
 
     else:
@@ -0,0 +1,380 @@
+"""
+Parallel table data copy for PostgreSQL Database Manager
+
+Copies the table data of one database into another over several
+connection pairs at once. A coordinating connection to the source exports
+a snapshot and keeps it open, with ACCESS SHARE locks on the copied
+tables, until the copy is done. Every worker connection imports that
+snapshot, so the workers (and pg_dump --snapshot, which copies the schema)
+all see the source as it was at one instant:
+
+    from parallel_copy import CopySession
+    session = CopySession("postgresql://...@prod/shop", "postgresql://...@staging/shop")
+    session.open()
+    print(session.snapshot)                  # for pg_dump --snapshot
+    # ... create the tables on the target ...
+    tables = session.tables()
+    pieces = session.plan(tables, split_bytes=1024 ** 3, max_splits=8)
+    session.copy(pieces, workers=8)
+    session.copy_sequences()
+    session.close()
+
+Each worker streams one piece at a time with COPY ... TO STDOUT on the
+source into COPY ... FROM STDIN on the target. The CopyData messages go
+from one socket to the other through a receive buffer the worker reuses,
+without being split into rows (see PgWireConnection.copy_out). Tables
+larger than split_bytes that have a single integer primary key are cut
+into key ranges that several workers copy at once, and the largest pieces
+go first so one big table doesn't finish last on its own.
+
+Only the built-in client from pg_wire is used, as no driver exposes the
+raw CopyData messages.
+"""
+
+import threading
+from collections import deque
+
+from pg_wire import PgWireConnection
+
+# Tables bigger than this are split by key range across workers
+COPY_SPLIT_BYTES = 1024 * 1024 * 1024
+# Sequences read or set per query
+SEQUENCE_BATCH = 200
+# Tables locked per LOCK TABLE statement
+LOCK_BATCH = 1000
+
+# The session settings pg_dump uses, so COPY text round-trips exactly
+# whatever the two servers' defaults are. pg_wire speaks UTF-8, and the
+# target converts the data to its own encoding.
+SESSION_SETTINGS = (
+    "SET client_encoding = 'UTF8'; SET datestyle = ISO; SET intervalstyle = postgres; "
+    "SET extra_float_digits = 3; SET statement_timeout = 0; SET lock_timeout = 0"
+)
+# Loading is repeatable, so don't wait for each COPY's commit to be flushed
+TARGET_SETTINGS = "SET synchronous_commit = off"
+
+USER_RELATION_FILTER = (
+    "n.nspname NOT IN ('pg_catalog', 'information_schema') "
+    "AND n.nspname NOT LIKE 'pg_toast%' AND n.nspname NOT LIKE 'pg_temp%' "
+    # pg_dump leaves extension members to CREATE EXTENSION
+    "AND NOT EXISTS (SELECT 1 FROM pg_catalog.pg_depend d "
+    "WHERE d.classid = 'pg_catalog.pg_class'::regclass AND d.objid = c.oid AND d.deptype = 'e')"
+)
+
+# Name, "schema.table" key, size (as in the backup census), copyable
+# columns and a single-column integer primary key to split by
+TABLES_QUERY = (
+    "SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname), "
+    "n.nspname || '.' || c.relname, "
+    "CASE WHEN c.relpages > 0 "
+    "THEN (c.relpages::bigint + COALESCE(t.relpages, 0)) "
+    "* current_setting('block_size')::bigint "
+    "ELSE pg_table_size(c.oid) END, "
+    "(SELECT string_agg(quote_ident(a.attname), ', ' ORDER BY a.attnum) "
+    "FROM pg_catalog.pg_attribute a "
+    "WHERE a.attrelid = c.oid AND a.attnum > 0 AND NOT a.attisdropped{generated}), "
+    "(SELECT quote_ident(a.attname) FROM pg_catalog.pg_index i "
+    "JOIN pg_catalog.pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0] "
+    "WHERE i.indrelid = c.oid AND i.indisprimary AND i.indnatts = 1 "
+    "AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)) "
+    "FROM pg_catalog.pg_class c "
+    "JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+    "LEFT JOIN pg_catalog.pg_class t ON t.oid = c.reltoastrelid "
+    "WHERE c.relkind = 'r' AND c.relpersistence <> 't' AND " + USER_RELATION_FILTER
+)
+# Generated columns (PostgreSQL 12+) are computed by the target, and COPY refuses them
+GENERATED_COLUMN_FILTER = " AND a.attgenerated = ''"
+
+RELATIONS_QUERY = (
+    "SELECT quote_ident(n.nspname) || '.' || quote_ident(c.relname) "
+    "FROM pg_catalog.pg_class c JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace "
+    "WHERE c.relkind = '{kind}' AND " + USER_RELATION_FILTER
+)
+
+FREE_CONNECTIONS_QUERY = (
+    "SELECT current_setting('max_connections')::int "
+    "- current_setting('superuser_reserved_connections')::int "
+    "- (SELECT count(*) FROM pg_stat_activity)"
+)
+
+
+def quote_literal(value):
+    """A string as an SQL literal (standard_conforming_strings is on since 9.1)"""
+    return "'" + value.replace("'", "''") + "'"
+
+
+def key_ranges(low, high, count):
+    """Split the keys low..high into count ranges as (start, stop) pairs
+
+    The first range has no start and the last no stop, so rows with keys
+    outside low..high (there are none in the snapshot) can't be missed.
+    """
+    count = max(1, min(count, high - low + 1))
+    bounds = [low + (high - low + 1) * i // count for i in range(1, count)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+
+class CopySession:
+    """The connections of one parallel copy, all reading one source snapshot"""
+
+    def __init__(self, source_db, target_db, timeout=None):
+        self.source_db = source_db
+        self.target_db = target_db
+        self.timeout = timeout
+        self.snapshot = None
+        self.server_version = None
+        self.lock = threading.Lock()
+        self._coordinator = None
+        self._target = None
+        self._connections = set()
+        self._stopping = False
+        self._streamed = []
+
+    def open(self):
+        """Connect to both databases and export the source snapshot"""
+        coordinator = self._connect(self.source_db)
+        self._coordinator = coordinator
+        version = int(coordinator.query("SHOW server_version_num")[0][0])
+        settings = SESSION_SETTINGS
+        if version >= 90600:
+            # The coordinator sits idle in its transaction while pg_dump runs
+            settings += "; SET idle_in_transaction_session_timeout = 0"
+        coordinator.query(settings)
+        coordinator.query("BEGIN ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+        self.snapshot = coordinator.query("SELECT pg_export_snapshot()")[0][0]
+        self.server_version = version
+        self._target = self._connect(self.target_db)
+        self._target.query(SESSION_SETTINGS)
+        return self
+
+    def close(self):
+        """Stop any workers, end the snapshot and disconnect"""
+        self.stop()
+        for connection in (self._coordinator, self._target):
+            if connection is not None:
+                connection.close()
+        self._coordinator = self._target = None
+
+    def stop(self):
+        """Fail every running COPY by shutting its connections down (from any thread)"""
+        with self.lock:
+            self._stopping = True
+            connections = list(self._connections)
+        for connection in connections:
+            connection.abort()
+
+    def free_connections(self):
+        """Connections still available to ordinary users on the busier of the two servers"""
+        return min(
+            int(connection.query(FREE_CONNECTIONS_QUERY)[0][0])
+            for connection in (self._coordinator, self._target)
+        )
+
+    def large_objects(self):
+        """How many large objects the source snapshot has"""
+        return int(self._coordinator.query("SELECT count(*) FROM pg_catalog.pg_largeobject_metadata")[0][0])
+
+    def tables(self):
+        """Source tables that also exist on the target, with what copying them needs
+
+        Returns dicts with "name" (quoted and schema-qualified), "key"
+        ("schema.table", as in the backup census), "bytes", "columns" (the
+        quoted column list) and "split_key" (None unless the table has a
+        single-column integer primary key).
+        """
+        generated = GENERATED_COLUMN_FILTER if self.server_version >= 120000 else ""
+        rows = self._coordinator.query(TABLES_QUERY.format(generated=generated))
+        existing = {row[0] for row in self._target.query(RELATIONS_QUERY.format(kind="r"))}
+        tables = [
+            {
+                "name": name,
+                "key": key,
+                "bytes": int(size or 0),
+                "columns": columns or "",
+                "split_key": split_key,
+            }
+            for name, key, size, columns, split_key in rows
+            if name in existing
+        ]
+        # Hold the tables as pg_dump would, so they can't be altered or dropped mid-copy
+        for start in range(0, len(tables), LOCK_BATCH):
+            names = ", ".join(table["name"] for table in tables[start : start + LOCK_BATCH])
+            self._coordinator.query(f"LOCK TABLE {names} IN ACCESS SHARE MODE")
+        return tables
+
+    def plan(self, tables, split_bytes=COPY_SPLIT_BYTES, max_splits=1):
+        """Cut tables into pieces to copy, largest first
+
+        A table over split_bytes with a split key becomes up to max_splits
+        key ranges. Each piece is a dict with "table" (the table's key),
+        "part" and "parts", an estimated "bytes", and the "source_sql" and
+        "target_sql" COPY commands.
+        """
+        pieces = []
+        for table in tables:
+            columns = f" ({table['columns']})" if table["columns"] else ""
+            target_sql = f"COPY {table['name']}{columns} FROM STDIN"
+            ranges = [(None, None)]
+            splits = min(max_splits, -(-table["bytes"] // split_bytes))
+            if table["split_key"] and splits > 1:
+                low, high = self._coordinator.query(
+                    f"SELECT min({table['split_key']}), max({table['split_key']}) FROM {table['name']}"
+                )[0]
+                if low is not None:
+                    ranges = key_ranges(int(low), int(high), splits)
+            for part, (start, stop) in enumerate(ranges, 1):
+                if len(ranges) == 1:
+                    source_sql = f"COPY {table['name']}{columns} TO STDOUT"
+                else:
+                    bounds = []
+                    if start is not None:
+                        bounds.append(f"{table['split_key']} >= {start}")
+                    if stop is not None:
+                        bounds.append(f"{table['split_key']} < {stop}")
+                    source_sql = (
+                        f"COPY (SELECT {table['columns'] or '*'} FROM {table['name']} "
+                        f"WHERE {' AND '.join(bounds)}) TO STDOUT"
+                    )
+                pieces.append(
+                    {
+                        "table": table["key"],
+                        "part": part,
+                        "parts": len(ranges),
+                        "bytes": table["bytes"] // len(ranges),
+                        "source_sql": source_sql,
+                        "target_sql": target_sql,
+                    }
+                )
+        pieces.sort(key=lambda piece: -piece["bytes"])
+        return pieces
+
+    def copy(self, pieces, workers, on_event=None, stop=None):
+        """Copy the pieces over workers connection pairs; blocks until done
+
+        on_event(event) is called from the workers with {"kind": "piece",
+        "action": "started" or "finished", "piece": ...}; a finished event
+        also has "rows" and "streamed" (bytes). Setting the threading.Event
+        stop fails the running COPYs and returns early. Raises the first
+        error a worker hit, after stopping the others.
+        """
+        if not pieces:
+            return 0
+        queue = deque(pieces)
+        workers = max(1, min(workers, len(pieces)))
+        self._streamed = [0] * workers
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self._work, args=(index, queue, errors, on_event), daemon=True
+            )
+            for index in range(workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.2)
+                if stop is not None and stop.is_set() and not self._stopping:
+                    self.stop()
+        if errors:
+            raise errors[0]
+        return workers
+
+    def sample(self):
+        """Bytes streamed so far by every worker (for progress sampling)"""
+        return sum(self._streamed)
+
+    def copy_sequences(self):
+        """Set the target's sequences to the source's values; returns how many were set
+
+        Sequences aren't transactional, so like pg_dump this reads their
+        current values rather than the snapshot's.
+        """
+        existing = {row[0] for row in self._target.query(RELATIONS_QUERY.format(kind="S"))}
+        names = [
+            row[0]
+            for row in self._coordinator.query(RELATIONS_QUERY.format(kind="S"))
+            if row[0] in existing
+        ]
+        for start in range(0, len(names), SEQUENCE_BATCH):
+            batch = names[start : start + SEQUENCE_BATCH]
+            values = self._coordinator.query(
+                " UNION ALL ".join(
+                    f"SELECT {index}, last_value, is_called FROM {name}"
+                    for index, name in enumerate(batch)
+                )
+            )
+            calls = [
+                f"pg_catalog.setval({quote_literal(batch[int(index)])}, {last_value}, "
+                f"{'true' if is_called == 't' else 'false'})"
+                for index, last_value, is_called in values
+            ]
+            self._target.query("SELECT " + ", ".join(calls))
+        return len(names)
+
+    def _connect(self, conn_string):
+        connection = PgWireConnection.connect(conn_string, self.timeout)
+        with self.lock:
+            self._connections.add(connection)
+            stopping = self._stopping
+        if stopping:
+            connection.abort()
+        return connection
+
+    def _disconnect(self, connection):
+        with self.lock:
+            self._connections.discard(connection)
+        connection.close()
+
+    def _work(self, index, queue, errors, on_event):
+        source = target = None
+        try:
+            source = self._connect(self.source_db)
+            source.query(SESSION_SETTINGS)
+            source.query(
+                "BEGIN ISOLATION LEVEL REPEATABLE READ, READ ONLY; "
+                f"SET TRANSACTION SNAPSHOT {quote_literal(self.snapshot)}"
+            )
+            target = self._connect(self.target_db)
+            target.query(f"{SESSION_SETTINGS}; {TARGET_SETTINGS}")
+            streamed = self._streamed
+            send = target.copy_data
+
+            def forward(data):
+                send(data)
+                streamed[index] += len(data)
+
+            while True:
+                with self.lock:
+                    if self._stopping or not queue:
+                        break
+                    piece = queue.popleft()
+                if on_event:
+                    on_event({"kind": "piece", "action": "started", "piece": piece})
+                before = streamed[index]
+                target.copy_in(piece["target_sql"])
+                source.copy_out(piece["source_sql"], forward)
+                rows = target.end_copy()
+                if on_event:
+                    on_event(
+                        {
+                            "kind": "piece",
+                            "action": "finished",
+                            "piece": piece,
+                            "rows": rows,
+                            "streamed": streamed[index] - before,
+                        }
+                    )
+            source.query("COMMIT")
+        except Exception as e:
+            with self.lock:
+                first = not self._stopping
+                if first:
+                    errors.append(e)
+            if first:
+                # One failed piece fails the copy; don't leave the others running
+                self.stop()
+        finally:
+            for connection in (source, target):
+                if connection is not None:
+                    self._disconnect(connection)
@@ -0,0 +1,187 @@
+"""Tests for parsing archive TOCs and choosing the entries of a selective restore"""
+
+import os
+
+import pytest
+
+from db_engine import ArchiveTOC, ArchiveTOCCache
+
+# "pg_restore --list -v" output for public.customers, public.orders (with a
+# serial id, an index, a foreign key to customers and a comment) and sales.q1
+LISTING = """;
+; Archive created at 2024-05-01 02:00:00 UTC
+;     dbname: shop
+;     Format: CUSTOM
+;
+5; 2615 16385 SCHEMA - sales postgres
+210; 1259 16386 TABLE public customers postgres
+211; 1259 16390 TABLE public orders postgres
+212; 1259 16395 SEQUENCE public orders_id_seq postgres
+213; 0 0 SEQUENCE OWNED BY public orders_id_seq postgres
+;\tdepends on: 212 211
+214; 2604 16396 DEFAULT public orders id postgres
+;\tdepends on: 212 211
+220; 1259 16400 TABLE sales q1 postgres
+;\tdepends on: 5
+3300; 0 16386 TABLE DATA public customers postgres
+;\tdepends on: 210
+3301; 0 16390 TABLE DATA public orders postgres
+;\tdepends on: 211
+3302; 0 16400 TABLE DATA sales q1 postgres
+;\tdepends on: 220
+3310; 0 0 SEQUENCE SET public orders_id_seq postgres
+;\tdepends on: 212
+3150; 2606 16410 CONSTRAINT public customers customers_pkey postgres
+;\tdepends on: 210
+3151; 2606 16411 CONSTRAINT public orders orders_pkey postgres
+;\tdepends on: 211
+3160; 1259 16412 INDEX public orders_customer_idx postgres
+;\tdepends on: 211
+3170; 2606 16413 FK CONSTRAINT public orders orders_customer_fkey postgres
+;\tdepends on: 211 3150
+3400; 0 0 COMMENT public TABLE orders postgres
+;\tdepends on: 211
+"""
+
+ORDERS = {211, 212, 213, 214, 3301, 3310, 3151, 3160, 3400}
+
+
+def without_dependencies(listing):
+    """The same listing as plain "pg_restore --list" prints it"""
+    return "\n".join(line for line in listing.splitlines() if "depends on" not in line)
+
+
+def test_parse_reads_header_entries_and_dependencies():
+    """Test that entries are split into type, schema, name, owner and section."""
+    toc = ArchiveTOC.parse(LISTING)
+    assert toc.format == "CUSTOM"
+    assert toc.supports_parallel
+    assert toc.header["dbname"] == "shop"
+    assert len(toc.entries) == 16
+
+    schema = toc.by_id[5]
+    assert (schema["desc"], schema["schema"], schema["name"]) == ("SCHEMA", "", "sales")
+    fk = toc.by_id[3170]
+    assert (fk["desc"], fk["schema"], fk["name"], fk["owner"]) == (
+        "FK CONSTRAINT",
+        "public",
+        "orders orders_customer_fkey",
+        "postgres",
+    )
+    assert fk["section"] == "post-data"
+    assert fk["depends"] == [211, 3150]
+    assert "depends" not in toc.by_id[210]
+    assert toc.section_counts() == {"pre-data": 8, "data": 4, "post-data": 4}
+    assert toc.section_counts({211, 3301}) == {"pre-data": 1, "data": 1, "post-data": 0}
+
+
+def test_tar_archives_are_not_parallel():
+    """Test that a tar archive's TOC rules out pg_restore -j."""
+    toc = ArchiveTOC.parse(LISTING.replace("Format: CUSTOM", "Format: TAR"))
+    assert not toc.supports_parallel
+
+
+def test_schemas_and_relations_for_browsing():
+    """Test the schema and table lists the restore browser shows."""
+    toc = ArchiveTOC.parse(LISTING)
+    assert toc.schemas() == ["public", "sales"]
+    assert [e["name"] for e in toc.relations()] == ["customers", "orders", "q1"]
+    assert [e["name"] for e in toc.relations("sales")] == ["q1"]
+    assert toc.relations("missing") == []
+
+
+def test_select_table_brings_its_attached_entries():
+    """Test that a table comes with its data, sequence, indexes and comment."""
+    toc = ArchiveTOC.parse(LISTING)
+    assert toc.select(tables=["public.orders"]) == ORDERS
+
+
+def test_select_leaves_out_foreign_keys_to_unselected_tables():
+    """Test that a foreign key is only restored along with the table it references."""
+    toc = ArchiveTOC.parse(LISTING)
+    assert 3170 not in toc.select(tables=["public.orders"])
+    both = toc.select(tables=["public.orders", "public.customers"])
+    assert both == ORDERS | {210, 3300, 3150, 3170}
+
+
+def test_select_schema_takes_everything_in_it_but_the_schema():
+    """Test that selecting a schema works like pg_restore -n."""
+    toc = ArchiveTOC.parse(LISTING)
+    assert toc.select(schemas=["sales"]) == {220, 3302}
+    assert toc.select(schemas=["sales"], tables=["public.customers"]) == {
+        220,
+        3302,
+        210,
+        3300,
+        3150,
+    }
+
+
+def test_select_unknown_names_raise():
+    """Test that a schema or table missing from the archive is an error."""
+    toc = ArchiveTOC.parse(LISTING)
+    with pytest.raises(ValueError, match="no schema 'archive'"):
+        toc.select(schemas=["archive"])
+    with pytest.raises(ValueError, match="no table 'public.invoices'"):
+        toc.select(tables=["public.invoices"])
+    with pytest.raises(ValueError, match="no table 'orders'"):
+        toc.select(tables=["orders"])
+
+
+def test_select_without_dependencies_matches_entries_by_name():
+    """Test selection from a listing that has no dependency lines."""
+    toc = ArchiveTOC.parse(without_dependencies(LISTING))
+    # Constraints, defaults and comments are tagged with the table's name;
+    # foreign keys are left out as their target is unknown
+    assert toc.select(tables=["public.orders"]) == {211, 214, 3301, 3151, 3400}
+
+
+def test_write_list_keeps_archive_order(tmp_path):
+    """Test that the -L list file names only the selected entries, in archive order."""
+    toc = ArchiveTOC.parse(LISTING)
+    path = str(tmp_path / "restore.list")
+    toc.write_list(path, {3301, 211, 3151})
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert lines == [
+        "; Selective restore: 3 of 16 entries",
+        "211; 1259 16390 TABLE public orders postgres",
+        "3301; 0 16390 TABLE DATA public orders postgres",
+        "3151; 2606 16411 CONSTRAINT public orders orders_pkey postgres",
+    ]
+
+
+def test_data_sizes_follow_the_table(tmp_path):
+    """Test that a table's size is that of its data entry, and survives the cache."""
+    toc = ArchiveTOC.parse(LISTING)
+    toc.data_sizes = {3301: 4096, 3302: 100}
+    orders = toc.by_name[("TABLE", "public", "orders")]
+    assert toc.data_size(orders) == 4096
+    assert toc.data_size(toc.by_id[210]) == 0
+    assert toc.selection_size(toc.select(tables=["public.orders"])) == 4096
+
+    copy = ArchiveTOC.from_dict(toc.to_dict())
+    assert copy.data_sizes == {3301: 4096, 3302: 100}
+    assert copy.select(tables=["public.orders"]) == ORDERS
+
+
+def test_cache_rereads_only_changed_dumps(tmp_path):
+    """Test that cached TOCs are reused until the dump is rewritten."""
+    dump = tmp_path / "shop.dump"
+    dump.write_bytes(b"PGDMP one")
+    reads = []
+
+    def read():
+        reads.append(1)
+        return ArchiveTOC.parse(LISTING)
+
+    cache_dir = str(tmp_path / "toc_cache")
+    assert ArchiveTOCCache(cache_dir).load(str(dump), read=read).by_id[211]
+    assert ArchiveTOCCache(cache_dir).load(str(dump), read=read).by_id[211]
+    assert len(reads) == 1
+
+    dump.write_bytes(b"PGDMP two, longer")
+    stat = os.stat(str(dump))
+    os.utime(str(dump), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    ArchiveTOCCache(cache_dir).load(str(dump), read=read)
+    assert len(reads) == 2
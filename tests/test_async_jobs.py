@@ -0,0 +1,192 @@
+"""Tests for running tool steps and jobs on the shared event loop with stand-in tools"""
+
+import hashlib
+import sys
+import threading
+import time
+
+import pytest
+
+import async_jobs
+from async_jobs import TIMEOUT_ERROR, AsyncJobRunner, submit_steps
+from db_engine import PipeBuffer, StreamingProcess, ToolStep
+
+CHUNK = 4096
+BUFFER = 16 * CHUNK
+TOTAL = 2 * 1024 * 1024
+
+PRODUCER = f"""
+import sys
+out = sys.stdout.buffer
+for _ in range({TOTAL // CHUNK}):
+    out.write(b"x" * {CHUNK})
+out.flush()
+"""
+
+ENDLESS_PRODUCER = f"""
+import sys
+while True:
+    sys.stdout.buffer.write(b"x" * {CHUNK})
+"""
+
+SLOW_CONSUMER = f"""
+import sys, time
+total = 0
+while True:
+    data = sys.stdin.buffer.read({CHUNK})
+    if not data:
+        break
+    total += len(data)
+    time.sleep(0.0005)
+sys.stderr.write("received %d\\n" % total)
+"""
+
+# Never reads its input, like a pg_restore stuck on a lock
+STUCK_CONSUMER = "import time; time.sleep(60)"
+
+DUMP = "import sys; sys.stdout.write('row\\n' * 1000)"
+
+# Upper-cases its input, standing in for gzip or zstd
+COMPRESSOR = "import sys; sys.stdout.write(sys.stdin.read().upper())"
+
+FAILING_COMPRESSOR = """
+import sys
+sys.stderr.write("gzip: stdout: No space left on device\\n")
+sys.exit(1)
+"""
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+def one_step(step):
+    """An operation that runs a single tool step and returns its outcome"""
+    outcome = yield step
+    return outcome
+
+
+def drive(step, timeout=None):
+    return submit_steps(one_step(step), timeout).result(30)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Read the source in chunks well under the buffer's size"""
+    monkeypatch.setattr(async_jobs, "PIPE_CHUNK_BYTES", CHUNK)
+
+
+def test_piped_step_holds_the_source_back(small_chunks):
+    """Test that a piped pair moves every byte without outgrowing the buffer."""
+    target = StreamingProcess(python(SLOW_CONSUMER))
+    buffer = PipeBuffer(max_bytes=BUFFER)
+    step = ToolStep(target, source=StreamingProcess(python(PRODUCER)), buffer=buffer)
+
+    assert drive(step) == (0, "")
+    assert target.tail() == f"received {TOTAL}\n"
+    assert buffer.transferred == TOTAL
+    assert 0 < buffer.peak <= BUFFER
+    assert buffer.stalls > 0
+
+
+@pytest.mark.parametrize("hashed", [False, True])
+def test_compressor_step_writes_the_output_file(tmp_path, hashed):
+    """Test tool | compressor > file, checksumming on the way when asked."""
+    path = str(tmp_path / "sales.sql.gz")
+    hasher = hashlib.sha256() if hashed else None
+    step = ToolStep(
+        StreamingProcess(python(DUMP)),
+        compressor=python(COMPRESSOR),
+        output_path=path,
+        hasher=hasher,
+    )
+
+    assert drive(step) == (0, "")
+    with open(path, "rb") as f:
+        output = f.read()
+    assert output == b"ROW\n" * 1000
+    if hashed:
+        assert hasher.hexdigest() == hashlib.sha256(output).hexdigest()
+
+
+def test_failing_compressor_fails_the_step(tmp_path):
+    """Test that a compressor error is reported though the tool succeeded."""
+    step = ToolStep(
+        StreamingProcess(python(DUMP)),
+        compressor=python(FAILING_COMPRESSOR),
+        output_path=str(tmp_path / "sales.sql.gz"),
+    )
+    assert drive(step) == (1, "gzip: stdout: No space left on device")
+
+
+def test_timeout_stops_a_piped_pair():
+    """Test that running out of time stops both tools and fails the step."""
+    source = StreamingProcess(python(ENDLESS_PRODUCER))
+    step = ToolStep(
+        StreamingProcess(python(STUCK_CONSUMER)), source=source, buffer=PipeBuffer(BUFFER)
+    )
+    started = time.monotonic()
+    code, error = drive(step, timeout=1)
+    assert code != 0 and error == TIMEOUT_ERROR
+    assert time.monotonic() - started < 10
+    assert source.process.poll() is not None
+    assert step.runner.process.poll() is not None
+
+
+class StandInEngine:
+    """Backups that run a sleeping stand-in tool instead of pg_dump"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = []
+
+    def backup_steps(self, source_db, filepath, control=None, seconds=0.5):
+        with self.lock:
+            self.started.append(filepath)
+        runner = StreamingProcess(python(f"import time; time.sleep({seconds})"), control=control)
+        code, error = yield ToolStep(runner)
+        if control.cancelled:
+            return {"success": False, "cancelled": True, "error": "Backup cancelled"}
+        return {"success": code == 0, "error": error}
+
+
+def test_per_server_limit_queues_only_that_servers_jobs():
+    """Test that a busy server's jobs wait without holding up another server."""
+    runner = AsyncJobRunner(StandInEngine(), max_jobs=8, max_per_server=1)
+    first = runner.backup("postgresql://u@db1:5432/sales", "first")
+    second = runner.backup("postgresql://u@db1:5432/shop", "second")
+    other = runner.backup("postgresql://u@db2:5432/sales", "other")
+    assert runner.wait(30)
+
+    assert [job.status for job in (first, second, other)] == ["success"] * 3
+    assert first.host == second.host == "db1:5432"
+    db1 = sorted((first, second), key=lambda job: job.started)
+    assert db1[1].started >= db1[0].ended
+    assert other.started < db1[0].ended
+    assert runner.counts() == {"success": 3}
+
+
+def test_cancel_while_queued_never_starts_the_job():
+    """Test that a queued job is cancelled without running, and a running one stops."""
+    engine = StandInEngine()
+    updates = []
+    runner = AsyncJobRunner(
+        engine, max_per_server=1, on_update=lambda job: updates.append((job.id, job.status))
+    )
+    running = runner.backup("postgresql://u@db1/sales", "running", seconds=60)
+    queued = runner.backup("postgresql://u@db1/shop", "queued")
+    deadline = time.monotonic() + 10
+    while running.status != "running" and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert runner.cancel(queued)
+    assert queued.wait(10) == {"success": False, "cancelled": True, "error": "Cancelled"}
+    assert queued.status == "cancelled" and queued.started is None
+    assert running.status == "running"
+
+    assert runner.cancel(running)
+    assert running.wait(10)["error"] == "Backup cancelled"
+    assert running.status == "cancelled"
+    assert not runner.cancel(running)
+    assert engine.started == ["running"]
+    assert (queued.id, "running") not in updates
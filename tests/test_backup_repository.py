@@ -0,0 +1,241 @@
+"""Tests for the deduplicating backup repository"""
+
+import functools
+import io
+import json
+import os
+import random
+import time
+
+import pytest
+
+import backup_repository
+from backup_repository import (
+    GC_GRACE_SECONDS,
+    BackupRepository,
+    RepositoryError,
+    iter_chunks,
+    manifest_location,
+)
+
+SMALL_CHUNKS = {"min_size": 256, "avg_size": 1024, "max_size": 4096}
+
+
+def copy_data(rows, seed=0, changed=()):
+    """Tab-separated COPY data as pg_dump writes it, with some rows edited"""
+    rng = random.Random(seed)
+    lines = []
+    for row in range(rows):
+        name = "edited" if row in changed else f"customer {rng.randrange(10 ** 6)}"
+        lines.append(f"{row}\t{name}\t{rng.random():.6f}\n")
+    return "".join(lines).encode("ascii") + b"\\.\n\n"
+
+
+def make_dump(path, rows=2000, **kwargs):
+    """A directory-format dump with a TOC and one table's data"""
+    os.makedirs(path)
+    with open(os.path.join(path, "toc.dat"), "wb") as f:
+        f.write(b"PGDMP" + bytes(range(64)))
+    with open(os.path.join(path, "3300.dat"), "wb") as f:
+        f.write(copy_data(rows, **kwargs))
+    return path
+
+
+def read_dir(path):
+    result = {}
+    for name in os.listdir(path):
+        with open(os.path.join(path, name), "rb") as f:
+            result[name] = f.read()
+    return result
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Cut stored files into kilobyte chunks so small dumps have many"""
+    monkeypatch.setattr(
+        backup_repository,
+        "iter_chunks",
+        functools.partial(iter_chunks, read_size=1000, **SMALL_CHUNKS),
+    )
+
+
+@pytest.fixture
+def repo(tmp_path, small_chunks):
+    return BackupRepository(str(tmp_path / "repository")).init()
+
+
+def test_chunks_rebuild_the_stream_within_size_bounds():
+    """Test that chunks concatenate to the input and respect min and max sizes."""
+    data = copy_data(3000) + bytes(range(256)) * 40  # text, then binary
+    reference = list(iter_chunks(io.BytesIO(data), **SMALL_CHUNKS))
+    assert len(reference) > 20
+    assert b"".join(reference) == data
+    assert all(256 <= len(chunk) <= 4096 for chunk in reference[:-1])
+    # Cut points depend on the content only, not on how it was read
+    for read_size in (1, 100, 4096):
+        stream = io.BytesIO(data)
+        assert list(iter_chunks(stream, read_size=read_size, **SMALL_CHUNKS)) == reference
+
+
+def test_edited_row_changes_only_nearby_chunks():
+    """Test that content-defined cuts don't shift after an edit in the middle."""
+    before = list(iter_chunks(io.BytesIO(copy_data(5000)), **SMALL_CHUNKS))
+    after = list(iter_chunks(io.BytesIO(copy_data(5000, changed={2500})), **SMALL_CHUNKS))
+    changed = set(after) - set(before)
+    assert 1 <= len(changed) <= 2
+    assert len(set(after) & set(before)) >= len(before) - 3
+
+
+def test_store_and_checkout_round_trip(repo, tmp_path):
+    """Test that a stored dump checks out byte for byte, whole or in part."""
+    dump = make_dump(str(tmp_path / "sales.dir"))
+    manifest = repo.store(dump, metadata={"database": "sales"})
+
+    assert manifest["id"] == "sales"
+    assert manifest["metadata"] == {"database": "sales"}
+    assert manifest["logical_bytes"] == sum(len(v) for v in read_dir(dump).values())
+    assert manifest["new_chunks"] == manifest["chunks"] > 2
+    assert repo.has_backup("sales")
+
+    target = repo.checkout("sales", str(tmp_path / "restored.dir"))
+    assert read_dir(target) == read_dir(dump)
+    toc_only = repo.checkout("sales", str(tmp_path / "toc.dir"), files=["toc.dat"])
+    assert list(read_dir(toc_only)) == ["toc.dat"]
+
+    staged = repo.checkout("sales")
+    assert os.path.dirname(staged) == repo.staging_dir
+    assert read_dir(staged) == read_dir(dump)
+    repo.release(staged)
+    assert not os.path.exists(staged)
+
+
+def test_store_deduplicates_unchanged_data(repo, tmp_path):
+    """Test that a second backup only adds the chunks that changed."""
+    first = repo.store(make_dump(str(tmp_path / "a.dir")), "monday")
+    same = repo.store(make_dump(str(tmp_path / "b.dir")), "tuesday")
+    edited = repo.store(make_dump(str(tmp_path / "c.dir"), changed={1000}), "wednesday")
+
+    assert same["added_bytes"] == 0 and same["new_chunks"] == 0
+    assert 1 <= edited["new_chunks"] <= 2
+    assert edited["added_bytes"] < first["added_bytes"] / 5
+
+    stats = repo.stats()
+    assert stats["backups"] == 3
+    assert stats["chunks"] == first["chunks"] + edited["new_chunks"]
+    assert stats["ratio"] > 2.5
+    assert [b["id"] for b in repo.backups()] == ["monday", "tuesday", "wednesday"]
+    assert repo.backups()[0]["files"] == 2
+
+
+def test_store_refuses_duplicates_and_non_dumps(repo, tmp_path):
+    """Test that ids are never overwritten and only directory dumps are stored."""
+    dump = make_dump(str(tmp_path / "sales.dir"))
+    repo.store(dump)
+    with pytest.raises(RepositoryError, match="already has a backup 'sales'"):
+        repo.store(dump)
+    with pytest.raises(RepositoryError, match="not a directory-format dump"):
+        repo.store(str(tmp_path), "other")
+    assert os.listdir(repo.pending_dir) == []
+
+
+def test_reserve_hands_out_unique_staging_folders(repo, tmp_path):
+    """Test that reserved names skip stored backups and other reservations."""
+    repo.store(make_dump(str(tmp_path / "sales.dir")), "sales_20250814")
+    first = repo.reserve("sales_20250814")
+    second = repo.reserve("sales_20250814")
+    assert os.path.basename(first) == "sales_20250814_2.dir"
+    assert os.path.basename(second) == "sales_20250814_3.dir"
+    repo.release(first)
+    assert repo.reserve("sales_20250814") == first
+
+
+def test_verify_reports_damaged_and_missing_chunks(repo, tmp_path):
+    """Test that verify finds bit rot with read_data and lost files either way."""
+    repo.store(make_dump(str(tmp_path / "sales.dir")), "sales")
+    assert repo.verify("sales") == []
+
+    chunks = repo.load_manifest("sales")["files"]["3300.dat"]["chunks"]
+    with open(repo.chunk_path(chunks[0]), "r+b") as f:
+        f.write(b"\0\0\0\0")
+    os.remove(repo.chunk_path(chunks[1]))
+
+    problems = repo.verify("sales")
+    assert len(problems) == 2
+    assert "damaged" in problems[0] and chunks[0] in problems[0]
+    assert problems[1] == f"Chunk {chunks[1]} is missing"
+    assert repo.verify("sales", read_data=False) == [f"Chunk {chunks[1]} is missing"]
+    with pytest.raises(RepositoryError, match="damaged"):
+        repo.checkout("sales", str(tmp_path / "restored.dir"))
+    assert not os.path.exists(str(tmp_path / "restored.dir"))
+
+
+def test_gc_frees_only_unreferenced_old_chunks(repo, tmp_path):
+    """Test that gc keeps shared chunks and those younger than the grace period."""
+    repo.store(make_dump(str(tmp_path / "a.dir")), "monday")
+    edited = repo.store(make_dump(str(tmp_path / "b.dir"), changed={1000}), "tuesday")
+    repo.delete("tuesday")
+    with pytest.raises(RepositoryError, match="No backup 'tuesday'"):
+        repo.delete("tuesday")
+
+    # Just written: everything is inside the grace period
+    assert repo.gc()["deleted_chunks"] == 0
+
+    later = BackupRepository(repo.path, clock=lambda: time.time() + 2 * GC_GRACE_SECONDS)
+    preview = later.gc(dry_run=True)
+    assert preview["deleted_chunks"] == edited["new_chunks"]
+    assert later.gc() == preview
+    assert later.gc()["deleted_chunks"] == 0
+    assert later.verify("monday") == []
+    assert later.stats()["chunks"] == preview["kept_chunks"]
+
+
+def test_gc_spares_chunks_of_a_backup_being_stored(repo, tmp_path):
+    """Test that a pending marker protects chunks written since it was made."""
+    repo.store(make_dump(str(tmp_path / "a.dir")), "monday")
+    repo.delete("monday")
+    marker = os.path.join(repo.pending_dir, "tuesday")
+    with open(marker, "w") as f:
+        f.write("1")
+    started = time.time() - 60
+    os.utime(marker, (started, started))
+
+    later = BackupRepository(repo.path, clock=lambda: time.time() + 2 * GC_GRACE_SECONDS)
+    result = later.gc()
+    assert result["deleted_chunks"] == 0 and result["young_chunks"] > 0
+
+    os.remove(marker)
+    assert later.gc()["deleted_chunks"] == result["young_chunks"]
+
+
+def test_gc_refuses_to_run_twice(repo):
+    """Test that a second collection fails while the lock file exists."""
+    with open(repo.gc_lock, "w"):
+        pass
+    with pytest.raises(RepositoryError, match="Another garbage collection"):
+        repo.gc()
+    assert os.path.exists(repo.gc_lock)
+
+
+def test_open_checks_the_repository(tmp_path):
+    """Test that open refuses missing repositories and newer formats."""
+    with pytest.raises(RepositoryError, match="not a backup repository"):
+        BackupRepository(str(tmp_path / "nothing")).open()
+    repo = BackupRepository(str(tmp_path / "repository")).init()
+    assert repo.open() is repo
+    assert BackupRepository.is_repository(repo.path)
+
+    config_path = os.path.join(repo.path, "config.json")
+    with open(config_path) as f:
+        config = json.load(f)
+    config["version"] = 99
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+    with pytest.raises(RepositoryError, match="format 99"):
+        repo.open()
+
+
+def test_manifest_location(repo, tmp_path):
+    """Test that a manifest path maps back to its repository and backup id."""
+    repo.store(make_dump(str(tmp_path / "sales.dir")), "sales")
+    assert manifest_location(repo.manifest_path("sales")) == (repo.path, "sales")
+    assert manifest_location(str(tmp_path / "sales.dir" / "toc.dat")) is None
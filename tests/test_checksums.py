@@ -0,0 +1,150 @@
+"""Tests for backup checksums: block hashing, the sidecar manifest and verification"""
+
+import hashlib
+import json
+import os
+
+import pytest
+
+from db_engine import (
+    BlockHasher,
+    ChecksumError,
+    OutputChecksummer,
+    checksum_manifest_path,
+    combined_checksum,
+    load_checksum_manifest,
+    verify_checksums,
+    write_checksum_manifest,
+)
+
+BLOCK = 16
+
+
+def digest_of(data, block_size=BLOCK):
+    hasher = BlockHasher(block_size)
+    hasher.update(data)
+    return {"size": len(data), "digest": hasher.hexdigest()}
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def make_dir_dump(path):
+    """A directory-format backup and the checksums of its files"""
+    os.makedirs(path)
+    contents = {"toc.dat": b"PGDMP" * 20, "3300.dat": bytes(range(200)), "3301.dat": b""}
+    for name, data in contents.items():
+        write(os.path.join(path, name), data)
+    return {name: digest_of(data) for name, data in contents.items()}
+
+
+def test_block_digest_is_the_hash_of_block_hashes():
+    """Test the digest's definition and that it ignores how writes were split."""
+    data = bytes(range(256)) * 3 + b"tail"
+    blocks = [data[i:i + BLOCK] for i in range(0, len(data), BLOCK)]
+    expected = hashlib.sha256(b"".join(hashlib.sha256(b).digest() for b in blocks))
+
+    for piece in (1, 7, BLOCK, 100, len(data)):
+        hasher = BlockHasher(BLOCK)
+        for start in range(0, len(data), piece):
+            hasher.update(data[start:start + piece])
+        assert hasher.size == len(data)
+        assert hasher.hexdigest() == expected.hexdigest()
+    assert BlockHasher(BLOCK).hexdigest() == hashlib.sha256(b"").hexdigest()
+
+
+def test_output_checksummer_follows_growing_files(tmp_path):
+    """Test that hashing while files grow gives the digest of the finished files."""
+    dump = str(tmp_path / "sales.dir")
+    os.makedirs(dump)
+    checksummer = OutputChecksummer(dump, block_size=BLOCK)
+    table = os.path.join(dump, "3300.dat")
+    written = b""
+    for step in range(5):
+        piece = bytes([step]) * 23
+        with open(table, "ab") as f:
+            f.write(piece)
+        written += piece
+        checksummer.catch_up()
+        # Only whole blocks are hashed while the file may still grow
+        assert checksummer.hashers["3300.dat"].size == len(written) // BLOCK * BLOCK
+    write(os.path.join(dump, "toc.dat"), b"PGDMP toc")
+
+    assert checksummer.finish() == {
+        "3300.dat": digest_of(written),
+        "toc.dat": digest_of(b"PGDMP toc"),
+    }
+
+
+def test_output_checksummer_rehashes_a_rewritten_header(tmp_path):
+    """Test that a single-file dump whose start is rewritten on close still matches."""
+    dump = str(tmp_path / "sales.dump")
+    write(dump, b"H" * 40 + b"data" * 20)
+    checksummer = OutputChecksummer(dump, block_size=BLOCK)
+    checksummer.catch_up()
+    with open(dump, "r+b") as f:
+        f.write(b"offsets!")
+    with open(dump, "rb") as f:
+        final = f.read()
+    assert checksummer.finish() == {"sales.dump": digest_of(final)}
+
+
+def test_manifest_round_trip_and_clean_verify(tmp_path):
+    """Test that the sidecar sits next to the backup and verifies clean."""
+    dump = str(tmp_path / "sales.dir")
+    files = make_dir_dump(dump)
+    manifest = write_checksum_manifest(dump + os.sep, files, block_size=BLOCK)
+
+    assert checksum_manifest_path(dump + os.sep) == dump + ".checksums.json"
+    assert load_checksum_manifest(dump) == manifest
+    assert manifest["digest"] == combined_checksum(files)
+    assert manifest["digest"] != combined_checksum(dict(files, extra=files["toc.dat"]))
+    assert verify_checksums(dump, workers=2) == []
+
+
+def test_verify_reports_every_problem(tmp_path):
+    """Test that verify names changed, truncated, missing and unexpected files."""
+    dump = str(tmp_path / "sales.dir")
+    write_checksum_manifest(dump, make_dir_dump(dump), block_size=BLOCK)
+
+    with open(os.path.join(dump, "3300.dat"), "r+b") as f:
+        f.seek(150)
+        f.write(b"\xff")
+    write(os.path.join(dump, "toc.dat"), b"PGDMP")
+    os.remove(os.path.join(dump, "3301.dat"))
+    write(os.path.join(dump, "3302.dat"), b"new")
+
+    assert verify_checksums(dump) == [
+        "3301.dat: missing",
+        "3302.dat: not in the checksum manifest",
+        "toc.dat: 5.0 B instead of 100.0 B",
+        "3300.dat: checksum mismatch",
+    ]
+
+
+def test_verify_single_file_backup(tmp_path):
+    """Test a single-file backup, and one without a manifest."""
+    dump = str(tmp_path / "sales.dump")
+    write(dump, b"PGDMP" * 100)
+    assert verify_checksums(dump) is None
+
+    write_checksum_manifest(dump, {"sales.dump": digest_of(b"PGDMP" * 100)}, BLOCK)
+    assert verify_checksums(dump) == []
+    write(dump, b"PGDMQ" * 100)
+    assert verify_checksums(dump) == ["sales.dump: checksum mismatch"]
+
+
+@pytest.mark.parametrize(
+    "content",
+    ["not json", json.dumps({"algorithm": "md5", "version": 1, "files": {}})],
+)
+def test_unreadable_manifests_raise(tmp_path, content):
+    """Test that a damaged or foreign manifest is an error, not a pass."""
+    dump = str(tmp_path / "sales.dump")
+    write(dump, b"PGDMP")
+    with open(checksum_manifest_path(dump), "w") as f:
+        f.write(content)
+    with pytest.raises(ChecksumError):
+        verify_checksums(dump)
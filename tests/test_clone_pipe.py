@@ -0,0 +1,192 @@
+"""Tests for piping one tool into another, with stand-in tool processes"""
+
+import sys
+import threading
+import time
+
+import pytest
+
+import db_engine
+from db_engine import PipeBuffer, StreamingProcess, piped_result, run_piped
+
+CHUNK = 4096
+BUFFER = 16 * CHUNK
+TOTAL = 2 * 1024 * 1024
+
+# Writes TOTAL bytes as fast as the pipe takes them
+PRODUCER = f"""
+import sys
+out = sys.stdout.buffer
+for _ in range({TOTAL // CHUNK}):
+    out.write(b"x" * {CHUNK})
+out.flush()
+"""
+
+# Writes forever; only stopped by being terminated or losing its reader
+ENDLESS_PRODUCER = f"""
+import sys
+while True:
+    sys.stdout.buffer.write(b"x" * {CHUNK})
+"""
+
+# Writes a little, then fails the way pg_dump does on a lost connection
+FAILING_PRODUCER = """
+import sys
+sys.stdout.buffer.write(b"x" * 10000)
+sys.stdout.buffer.flush()
+sys.stderr.write("pg_dump: error: connection to server was lost\\n")
+sys.exit(1)
+"""
+
+# Reads slowly to the end and reports how much it got
+SLOW_CONSUMER = f"""
+import sys, time
+total = 0
+while True:
+    data = sys.stdin.buffer.read({CHUNK})
+    if not data:
+        break
+    total += len(data)
+    time.sleep(0.0005)
+sys.stderr.write("received %d\\n" % total)
+"""
+
+# Reads one chunk, then fails the way pg_restore does on a bad archive
+FAILING_CONSUMER = f"""
+import sys
+sys.stdin.buffer.read({CHUNK})
+sys.stderr.write("pg_restore: error: could not read input file\\n")
+sys.exit(2)
+"""
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    """Read the source in chunks well under the buffer's size"""
+    monkeypatch.setattr(db_engine, "PIPE_CHUNK_BYTES", CHUNK)
+
+
+def pipe(producer, consumer, timeout=30):
+    """Run producer into consumer through a small buffer, failing on a hang"""
+    source = StreamingProcess(python(producer))
+    target = StreamingProcess(python(consumer))
+    buffer = PipeBuffer(max_bytes=BUFFER)
+    outcome = {}
+
+    def run():
+        outcome["result"] = run_piped(source, target, buffer)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "run_piped did not return"
+    return outcome["result"], source, target, buffer
+
+
+def test_slow_consumer_holds_the_producer_back(small_chunks):
+    """Test that the buffer never grows past its size and every byte arrives."""
+    result, source, target, buffer = pipe(PRODUCER, SLOW_CONSUMER)
+    assert result == (0, "")
+    assert target.tail() == f"received {TOTAL}\n"
+    assert buffer.transferred == TOTAL
+    assert 0 < buffer.peak <= BUFFER
+    assert buffer.stalls > 0
+
+
+def test_failing_producer_is_blamed(small_chunks):
+    """Test that a source exiting early reports its own error and exit code."""
+    result, source, target, buffer = pipe(FAILING_PRODUCER, SLOW_CONSUMER)
+    assert result == (1, "pg_dump: error: connection to server was lost")
+    assert target.process.returncode == 0
+    assert target.tail() == "received 10000\n"
+
+
+def test_failing_consumer_stops_the_producer(small_chunks):
+    """Test that a target exiting early is blamed and the source is stopped."""
+    started = time.monotonic()
+    result, source, target, buffer = pipe(ENDLESS_PRODUCER, FAILING_CONSUMER)
+    assert result == (2, "")
+    assert target.errors[0] == "pg_restore: error: could not read input file"
+    assert source.process.returncode != 0
+    assert buffer.aborted
+    # Well before CANCEL_GRACE_SECONDS would have the source killed
+    assert time.monotonic() - started < db_engine.CANCEL_GRACE_SECONDS
+
+
+def test_pipe_buffer_put_waits_for_room():
+    """Test that put blocks while full, counts the stall and resumes after a get."""
+    buffer = PipeBuffer(max_bytes=10)
+    assert buffer.put(b"12345678")
+    done = threading.Event()
+
+    def put():
+        buffer.put(b"abcd")
+        done.set()
+
+    threading.Thread(target=put, daemon=True).start()
+    assert not done.wait(0.1)
+    assert buffer.get() == b"12345678"
+    assert done.wait(5)
+    assert buffer.stalls == 1 and buffer.peak == 8
+    buffer.close()
+    assert buffer.get() == b"abcd"
+    assert buffer.get() == b""
+    assert buffer.transferred == buffer.sample() == 12
+
+
+def test_pipe_buffer_abort_releases_the_producer():
+    """Test that abort wakes a waiting put, which then refuses the data."""
+    buffer = PipeBuffer(max_bytes=4)
+    # A chunk bigger than the buffer still fits when it's empty
+    assert buffer.put(b"oversized")
+    outcome = []
+    thread = threading.Thread(target=lambda: outcome.append(buffer.put(b"more")))
+    thread.start()
+    time.sleep(0.05)
+    buffer.abort()
+    thread.join(5)
+    assert outcome == [False]
+    assert buffer.buffered == 0 and buffer.get() == b""
+    assert not buffer.put(b"late")
+
+
+class Finished:
+    """A StreamingProcess that already ran"""
+
+    def __init__(self, cmd, report=""):
+        self.cmd = cmd
+        self.report = report
+
+    def error_report(self):
+        return self.report
+
+
+@pytest.mark.parametrize(
+    "source_code, target_code, aborted, expected",
+    [
+        (0, 0, True, (0, "")),
+        (1, 0, True, (1, "dump failed")),
+        (1, 3, False, (1, "dump failed")),
+        (1, 3, True, (3, "")),
+        (0, 3, True, (3, "")),
+    ],
+)
+def test_piped_result_blames_the_tool_that_failed_first(
+    source_code, target_code, aborted, expected
+):
+    """Test that the source is blamed unless the target had already stopped reading."""
+    buffer = PipeBuffer()
+    buffer.aborted = aborted
+    source = Finished(["/usr/bin/pg_dump"], "dump failed")
+    assert piped_result(source, source_code, target_code, buffer) == expected
+
+
+def test_piped_result_names_a_silent_source():
+    """Test the fallback message when the failed source printed nothing."""
+    buffer = PipeBuffer()
+    source = Finished(["/usr/bin/pg_dump", "-Fc"])
+    assert piped_result(source, 1, 0, buffer) == (1, "pg_dump failed")
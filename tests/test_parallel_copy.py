@@ -0,0 +1,152 @@
+"""Tests for cutting tables into the pieces a parallel copy streams"""
+
+import pytest
+
+from parallel_copy import CopySession, key_ranges, quote_literal
+
+GB = 1024 ** 3
+
+
+class KeyBounds:
+    """Answers the plan's min/max key queries from a table -> (low, high) map"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.queries = []
+
+    def query(self, sql):
+        self.queries.append(sql)
+        table = sql.rsplit(" FROM ", 1)[1]
+        return [self.bounds[table]]
+
+
+def in_range(key, start, stop):
+    return (start is None or key >= start) and (stop is None or key < stop)
+
+
+@pytest.mark.parametrize(
+    "low, high, count",
+    [(1, 100, 4), (1, 10, 3), (-50, 49, 7), (0, 2 ** 40, 8), (5, 7, 10), (9, 9, 4)],
+)
+def test_key_ranges_cover_every_key_once(low, high, count):
+    """Test that each key falls in exactly one range and ranges are balanced."""
+    ranges = key_ranges(low, high, count)
+    assert len(ranges) == min(count, high - low + 1)
+    assert ranges[0][0] is None and ranges[-1][1] is None
+    for (_, stop), (start, _) in zip(ranges, ranges[1:]):
+        assert stop == start
+
+    small = high - low < 10 ** 4
+    keys = range(low, high + 1) if small else (low, (low + high) // 2, high)
+    for key in keys:
+        assert sum(in_range(key, start, stop) for start, stop in ranges) == 1
+    # Keys outside low..high (none exist in the snapshot) still land somewhere
+    assert in_range(low - 1000, *ranges[0]) and in_range(high + 1000, *ranges[-1])
+
+    if small:
+        sizes = [sum(in_range(key, *r) for key in keys) for r in ranges]
+        assert max(sizes) - min(sizes) <= 1
+
+
+def test_key_ranges_of_one():
+    """Test that a single range is unbounded."""
+    assert key_ranges(1, 1000, 1) == [(None, None)]
+    assert key_ranges(1, 1000, 0) == [(None, None)]
+
+
+def table(name, size, split_key="id", columns="id, name"):
+    return {
+        "name": f"public.{name}",
+        "key": f"public.{name}",
+        "bytes": size,
+        "columns": columns,
+        "split_key": split_key,
+    }
+
+
+def make_session(bounds):
+    session = CopySession("postgresql://source/shop", "postgresql://target/shop")
+    session._coordinator = KeyBounds(bounds)
+    return session
+
+
+def test_plan_splits_large_tables_by_key_range():
+    """Test that a big table with an integer key becomes ranged COPY queries."""
+    session = make_session({"public.orders": ("1", "1000")})
+    pieces = session.plan([table("orders", 5 * GB)], split_bytes=GB, max_splits=4)
+
+    assert [(p["part"], p["parts"], p["bytes"]) for p in pieces] == [
+        (part, 4, 5 * GB // 4) for part in range(1, 5)
+    ]
+    assert [p["source_sql"] for p in pieces] == [
+        "COPY (SELECT id, name FROM public.orders WHERE id < 251) TO STDOUT",
+        "COPY (SELECT id, name FROM public.orders WHERE id >= 251 AND id < 501) TO STDOUT",
+        "COPY (SELECT id, name FROM public.orders WHERE id >= 501 AND id < 751) TO STDOUT",
+        "COPY (SELECT id, name FROM public.orders WHERE id >= 751) TO STDOUT",
+    ]
+    assert {p["target_sql"] for p in pieces} == {
+        "COPY public.orders (id, name) FROM STDIN"
+    }
+    assert session._coordinator.queries == [
+        "SELECT min(id), max(id) FROM public.orders"
+    ]
+
+
+def test_plan_splits_only_as_far_as_the_size_calls_for():
+    """Test that the number of ranges follows the size, up to max_splits."""
+    session = make_session({"public.a": ("1", "100"), "public.b": ("1", "100")})
+    pieces = session.plan(
+        [table("a", GB + 1), table("b", 20 * GB)], split_bytes=GB, max_splits=8
+    )
+    parts = {(p["table"], p["parts"]) for p in pieces}
+    assert parts == {("public.a", 2), ("public.b", 8)}
+
+
+def test_plan_copies_unsplittable_tables_whole():
+    """Test small tables, tables without a key, empty tables and max_splits=1."""
+    session = make_session({"public.empty": (None, None)})
+    pieces = session.plan(
+        [
+            table("small", GB // 2),
+            table("nokey", 5 * GB, split_key=None),
+            table("empty", 5 * GB),
+            table("nocols", 10, columns=""),
+        ],
+        split_bytes=GB,
+        max_splits=4,
+    )
+    assert [(p["table"], p["parts"], p["source_sql"]) for p in pieces] == [
+        ("public.nokey", 1, "COPY public.nokey (id, name) TO STDOUT"),
+        ("public.empty", 1, "COPY public.empty (id, name) TO STDOUT"),
+        ("public.small", 1, "COPY public.small (id, name) TO STDOUT"),
+        ("public.nocols", 1, "COPY public.nocols TO STDOUT"),
+    ]
+    assert pieces[-1]["target_sql"] == "COPY public.nocols FROM STDIN"
+
+    whole = make_session({}).plan([table("orders", 5 * GB)], split_bytes=GB)
+    assert [p["parts"] for p in whole] == [1]
+
+
+def test_plan_puts_the_largest_pieces_first():
+    """Test that pieces are ordered by size so big tables don't finish last."""
+    session = make_session({"public.big": ("0", "99")})
+    pieces = session.plan(
+        [
+            table("small", 10),
+            table("big", 4 * GB),
+            table("medium", 3 * GB // 2, split_key=None),
+        ],
+        split_bytes=GB,
+        max_splits=4,
+    )
+    assert [p["bytes"] for p in pieces] == sorted(
+        (p["bytes"] for p in pieces), reverse=True
+    )
+    order = [p["table"] for p in pieces]
+    assert order == ["public.medium"] + ["public.big"] * 4 + ["public.small"]
+
+
+def test_quote_literal():
+    """Test that quotes are doubled for snapshot ids and sequence names."""
+    assert quote_literal("00000003-0000001B-1") == "'00000003-0000001B-1'"
+    assert quote_literal('public."o\'clock"') == "'public.\"o''clock\"'"
@@ -0,0 +1,92 @@
+"""Tests for turning verbose pg_dump/pg_restore lines into progress events"""
+
+import pytest
+
+from db_engine import parse_progress_line, split_desc
+
+
+def test_item_lines():
+    """Test that item lines keep the action, dump id and split entry type."""
+    line = "pg_restore: processing item 3300 TABLE DATA public orders\n"
+    assert parse_progress_line(line) == {
+        "tool": "pg_restore",
+        "kind": "item",
+        "action": "processing",
+        "dump_id": 3300,
+        "desc": "TABLE DATA",
+        "target": "public orders",
+    }
+    line = "pg_restore: processing missed item 3151 FK CONSTRAINT public b b_fkey\r\n"
+    event = parse_progress_line(line)
+    assert (event["action"], event["dump_id"], event["desc"], event["target"]) == (
+        "processing missed",
+        3151,
+        "FK CONSTRAINT",
+        "public b b_fkey",
+    )
+    for action in ("launching", "finished"):
+        event = parse_progress_line(f"pg_restore: {action} item 12 INDEX public a_idx")
+        assert event["action"] == action
+
+
+def test_table_data_lines():
+    """Test both tools' table data lines, with quoted names kept whole."""
+    line = 'pg_dump: dumping contents of table "public.order lines"'
+    assert parse_progress_line(line) == {
+        "tool": "pg_dump",
+        "kind": "table_data",
+        "action": "dumping",
+        "desc": "TABLE DATA",
+        "target": "public.order lines",
+    }
+    event = parse_progress_line('pg_restore: processing data for table "sales.q1"')
+    assert event["tool"] == "pg_restore"
+    assert (event["action"], event["target"]) == ("restoring", "sales.q1")
+
+
+def test_create_lines():
+    """Test that multi-word object types in creating lines are kept whole."""
+    event = parse_progress_line('pg_restore: creating FK CONSTRAINT "public.b b_a_fkey"')
+    assert event == {
+        "tool": "pg_restore",
+        "kind": "create",
+        "action": "creating",
+        "desc": "FK CONSTRAINT",
+        "target": "public.b b_a_fkey",
+    }
+
+
+@pytest.mark.parametrize("kind", ["error", "warning", "detail", "hint"])
+def test_message_lines(kind):
+    """Test that errors, warnings, details and hints become message events."""
+    event = parse_progress_line(f'pg_restore: {kind}: relation "a" already exists')
+    assert event == {
+        "tool": "pg_restore",
+        "kind": kind,
+        "message": 'relation "a" already exists',
+    }
+
+
+@pytest.mark.parametrize(
+    "line",
+    [
+        "",
+        "pg_restore: connecting to database for restore",
+        "pg_dump: reading extensions",
+        "psql: error: connection refused",
+        "pg_restore: processing item x TABLE a",
+        "Command was: CREATE TABLE a (id integer);",
+    ],
+)
+def test_other_lines_are_ignored(line):
+    """Test that lines without progress information give None."""
+    assert parse_progress_line(line) is None
+
+
+def test_split_desc_prefers_the_longest_entry_type():
+    """Test that split_desc knows multi-word TOC entry types."""
+    assert split_desc("TABLE DATA public a") == ("TABLE DATA", "public a")
+    assert split_desc("TABLE public a") == ("TABLE", "public a")
+    assert split_desc("SEQUENCE OWNED BY public s") == ("SEQUENCE OWNED BY", "public s")
+    assert split_desc("MATERIALIZED VIEW DATA") == ("MATERIALIZED VIEW DATA", "")
+    assert split_desc("EXTENSION - pgcrypto") == ("EXTENSION", "- pgcrypto")
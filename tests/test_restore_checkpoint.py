@@ -0,0 +1,159 @@
+"""Tests for RestoreCheckpoint, replaying pg_restore -v transcripts"""
+
+import json
+
+from db_engine import ArchiveTOC, RestoreCheckpoint, parse_progress_line
+
+LISTING = """;
+; Archive created at 2024-05-01 02:00:00 UTC
+;     dbname: shop
+;     Format: CUSTOM
+;
+5; 2615 16385 SCHEMA - app postgres
+210; 1259 16386 TABLE public a postgres
+211; 1259 16390 TABLE public b postgres
+3300; 0 16386 TABLE DATA public a postgres
+3301; 0 16390 TABLE DATA public b postgres
+3150; 2606 16400 CONSTRAINT public a a_pkey postgres
+3151; 2606 16401 CONSTRAINT public b b_pkey postgres
+3400; 0 0 ACL - SCHEMA public postgres
+"""
+
+
+def replay(checkpoint, transcript):
+    for line in transcript.strip().splitlines():
+        event = parse_progress_line(line)
+        if event:
+            checkpoint.on_event(event)
+    return checkpoint
+
+
+def test_parallel_worker_lines_do_not_complete_launched_items():
+    """Test that workers' lines don't mark launched but unfinished items done."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING), parallel=True),
+        """
+pg_restore: entering main parallel loop
+pg_restore: launching item 3300 TABLE DATA public a
+pg_restore: launching item 3301 TABLE DATA public b
+pg_restore: processing data for table "public.a"
+pg_restore: processing data for table "public.b"
+""",
+    )
+    assert checkpoint.done == set()
+    assert checkpoint.remaining() == [5, 210, 211, 3300, 3301, 3150, 3151, 3400]
+
+
+def test_parallel_transcript_resumes_unfinished_items():
+    """Test that a cancelled parallel restore only skips what finished."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING), parallel=True),
+        """
+pg_restore: connecting to database for restore
+pg_restore: processing item 5 SCHEMA app
+pg_restore: creating SCHEMA "app"
+pg_restore: processing item 210 TABLE a
+pg_restore: creating TABLE "public.a"
+pg_restore: processing item 211 TABLE b
+pg_restore: creating TABLE "public.b"
+pg_restore: entering main parallel loop
+pg_restore: launching item 3300 TABLE DATA a
+pg_restore: launching item 3301 TABLE DATA b
+pg_restore: processing data for table "public.a"
+pg_restore: processing data for table "public.b"
+pg_restore: finished item 3300 TABLE DATA a
+pg_restore: launching item 3150 CONSTRAINT a a_pkey
+pg_restore: creating CONSTRAINT "public.a a_pkey"
+""",
+    )
+    # The leader's own entries are done once it launches the first worker
+    assert checkpoint.done == {5, 210, 211, 3300}
+    assert checkpoint.remaining() == [3301, 3150, 3151, 3400]
+
+
+def test_parallel_leader_entry_in_progress_is_redone():
+    """Test that the entry the leader is working on when stopped is not done."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING), parallel=True),
+        """
+pg_restore: processing item 5 SCHEMA app
+pg_restore: processing item 210 TABLE a
+pg_restore: creating TABLE "public.a"
+""",
+    )
+    assert checkpoint.done == {5}
+
+
+def test_serial_transcript_infers_entries_in_archive_order():
+    """Test that a serial restore counts everything before the current entry done."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING)),
+        """
+pg_restore: connecting to database for restore
+pg_restore: creating SCHEMA "app"
+pg_restore: creating TABLE "public.a"
+pg_restore: creating TABLE "public.b"
+pg_restore: processing data for table "public.a"
+pg_restore: processing data for table "public.b"
+""",
+    )
+    # public.b's COPY was in progress, so it is redone
+    assert checkpoint.done == {5, 210, 211, 3300}
+    assert checkpoint.remaining() == [3301, 3150, 3151, 3400]
+
+
+def test_serial_transcript_skips_entries_it_never_saw():
+    """Test that entries skipped over in archive order still count as done."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING)),
+        """
+pg_restore: creating TABLE "public.a"
+pg_restore: creating CONSTRAINT "public.a a_pkey"
+""",
+    )
+    assert checkpoint.remaining() == [3150, 3151, 3400]
+
+
+def test_checkpoint_is_limited_to_selected_entries():
+    """Test that a selective restore's checkpoint ignores other entries."""
+    checkpoint = replay(
+        RestoreCheckpoint(ArchiveTOC.parse(LISTING), dump_ids={211, 3301, 3151}),
+        """
+pg_restore: creating TABLE "public.a"
+pg_restore: creating TABLE "public.b"
+pg_restore: processing data for table "public.b"
+""",
+    )
+    assert checkpoint.remaining() == [3301, 3151]
+
+
+def test_save_writes_remaining_entries(tmp_path):
+    """Test that save() writes the details and the entries still to restore."""
+    path = str(tmp_path / "checkpoints" / "shop.json")
+    checkpoint = RestoreCheckpoint(
+        ArchiveTOC.parse(LISTING), parallel=True, path=path, details={"total": 8}
+    )
+    replay(checkpoint, "pg_restore: finished item 3300 TABLE DATA a")
+    checkpoint.save()
+
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    assert state["total"] == 8
+    assert state["remaining"] == [5, 210, 211, 3301, 3150, 3151, 3400]
+
+
+def test_checkpoint_saves_on_a_timer(tmp_path):
+    """Test that progress is saved once the save interval has passed."""
+    now = [0.0]
+    path = tmp_path / "shop.json"
+    checkpoint = RestoreCheckpoint(
+        ArchiveTOC.parse(LISTING), parallel=True, path=str(path), clock=lambda: now[0]
+    )
+    replay(checkpoint, "pg_restore: finished item 3300 TABLE DATA a")
+    assert not path.exists()
+
+    now[0] = 10.0
+    replay(checkpoint, "pg_restore: finished item 3301 TABLE DATA b")
+    assert json.loads(path.read_text(encoding="utf-8"))["remaining"] == [
+        5, 210, 211, 3150, 3151, 3400
+    ]
@@ -0,0 +1,112 @@
+"""Tests for RestoreProgress, replaying pg_restore -v transcripts"""
+
+from db_engine import ArchiveTOC, RestoreProgress, parse_progress_line
+
+LISTING = """;
+;     Format: CUSTOM
+;
+210; 1259 16386 TABLE public a postgres
+211; 1259 16390 TABLE public b postgres
+212; 1259 16394 TABLE public c postgres
+3300; 0 16386 TABLE DATA public a postgres
+3301; 0 16390 TABLE DATA public b postgres
+3302; 0 16394 TABLE DATA public c postgres
+3150; 2606 16400 CONSTRAINT public a a_pkey postgres
+"""
+
+
+def make_toc():
+    toc = ArchiveTOC.parse(LISTING)
+    toc.data_sizes = {3300: 600, 3301: 300, 3302: 100}
+    return toc
+
+
+def replay(progress, transcript):
+    for line in transcript.strip().splitlines():
+        event = parse_progress_line(line)
+        if event:
+            progress.on_event(event)
+    return progress.sample()
+
+
+def test_parallel_progress_counts_only_finished_items():
+    """Test that workers' lines don't count launched tables as restored."""
+    now = [0.0]
+    progress = RestoreProgress(clock=lambda: now[0], parallel=True)
+    progress.set_toc(make_toc())
+
+    sample = replay(
+        progress,
+        """
+pg_restore: processing item 210 TABLE a
+pg_restore: processing item 211 TABLE b
+pg_restore: processing item 212 TABLE c
+pg_restore: entering main parallel loop
+pg_restore: launching item 3300 TABLE DATA a
+pg_restore: launching item 3301 TABLE DATA b
+pg_restore: processing data for table "public.a"
+pg_restore: processing data for table "public.b"
+""",
+    )
+    assert sample["fraction"] == 0.0
+    assert sample["tables_done"] == 0
+    assert sample["eta"] is None
+
+    now[0] = 10.0
+    sample = replay(
+        progress,
+        """
+pg_restore: finished item 3301 TABLE DATA b
+pg_restore: launching item 3302 TABLE DATA c
+pg_restore: processing data for table "public.c"
+""",
+    )
+    assert sample["fraction"] == 0.3
+    assert sample["tables_done"] == 1
+    # 300 bytes in 10 s, 700 to go
+    assert round(sample["eta"], 6) == round(10.0 * 700 / 300, 6)
+
+
+def test_serial_progress_counts_previous_table_done():
+    """Test that a serial restore counts a table once the next one starts."""
+    progress = RestoreProgress()
+    progress.set_toc(make_toc())
+
+    sample = replay(
+        progress,
+        """
+pg_restore: processing data for table "public.a"
+pg_restore: processing data for table "public.b"
+""",
+    )
+    assert sample["fraction"] == 0.6
+    assert sample["tables_done"] == 1
+    assert sample["tables_total"] == 3
+
+
+def test_progress_without_sizes_weighs_tables_equally():
+    """Test that a TOC without stored sizes counts every table the same."""
+    progress = RestoreProgress(parallel=True)
+    progress.set_toc(ArchiveTOC.parse(LISTING))
+
+    sample = replay(
+        progress,
+        """
+pg_restore: launching item 3300 TABLE DATA a
+pg_restore: finished item 3300 TABLE DATA a
+pg_restore: finished item 3150 CONSTRAINT a a_pkey
+""",
+    )
+    assert sample["fraction"] == 1 / 3
+    assert sample["post_data_done"] == 1
+    assert sample["post_data_total"] == 1
+
+
+def test_selective_restore_only_weighs_selected_tables():
+    """Test that set_toc with dump ids ignores the other tables' data."""
+    progress = RestoreProgress(parallel=True)
+    progress.set_toc(make_toc(), {211, 3301})
+
+    sample = replay(progress, "pg_restore: finished item 3301 TABLE DATA b")
+    assert sample["fraction"] == 1.0
+    assert sample["tables_total"] == 1
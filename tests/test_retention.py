@@ -0,0 +1,160 @@
+"""Tests for retention planning and pruning over the backup catalog"""
+
+import pytest
+
+from db_engine import DatabaseEngine, normalize_retention_policy, plan_retention
+
+
+def backup(backup_id, created, database="app", host="db1"):
+    return {
+        "id": backup_id,
+        "created": created,
+        "database": database,
+        "host": host,
+        "file_path": f"/backups/{backup_id}.dump",
+        "size": 100,
+    }
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = DatabaseEngine(str(tmp_path / "app_data"))
+    yield engine
+    engine.close()
+
+
+def write_backup(path, content="dump"):
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_plan_retention_keeps_newest_backup_per_day():
+    """Test that daily retention keeps the newest backup of each recent day."""
+    backups = [
+        backup(1, "2024-05-01 02:00:00"),
+        backup(2, "2024-05-01 14:00:00"),
+        backup(3, "2024-05-02 02:00:00"),
+        backup(4, "2024-05-03 02:00:00"),
+    ]
+    keep, expire = plan_retention(backups, {"daily": 2, "weekly": 0, "monthly": 0})
+
+    assert [b["id"] for b in keep] == [4, 3]
+    assert [b["id"] for b in expire] == [2, 1]
+    assert keep[0]["kept_by"] == ["daily"]
+
+
+def test_plan_retention_combines_rules():
+    """Test that weekly and monthly rules keep older backups the daily rule drops."""
+    backups = [
+        backup(1, "2024-03-31 02:00:00"),  # March, ISO week 13
+        backup(2, "2024-04-07 02:00:00"),  # April, ISO week 14
+        backup(3, "2024-04-08 02:00:00"),  # ISO week 15
+        backup(4, "2024-04-09 02:00:00"),
+    ]
+    keep, expire = plan_retention(backups, {"daily": 1, "weekly": 2, "monthly": 3})
+
+    kept = {b["id"]: b["kept_by"] for b in keep}
+    assert kept == {
+        4: ["daily", "weekly", "monthly"],
+        2: ["weekly"],
+        1: ["monthly"],
+    }
+    assert [b["id"] for b in expire] == [3]
+
+
+def test_plan_retention_always_keeps_newest():
+    """Test that the newest backup survives any policy."""
+    keep, expire = plan_retention(
+        [backup(1, "2020-01-01 00:00:00")], {"daily": 0, "weekly": 0, "monthly": 1}
+    )
+    assert [b["id"] for b in keep] == [1]
+    assert expire == []
+
+
+def test_normalize_retention_policy_validates_input():
+    """Test that policies are parsed from text and rejected when empty or negative."""
+    assert normalize_retention_policy({"daily": "7", "weekly": "", "monthly": 2}) == {
+        "daily": 7,
+        "weekly": 0,
+        "monthly": 2,
+    }
+    with pytest.raises(ValueError):
+        normalize_retention_policy({"daily": 0})
+    with pytest.raises(ValueError):
+        normalize_retention_policy({"daily": -1})
+    with pytest.raises(ValueError):
+        normalize_retention_policy({"daily": "seven"})
+
+
+def test_reused_backup_path_replaces_catalog_row(engine, tmp_path):
+    """Test that a backup written over an older one isn't deleted by pruning."""
+    engine.set_retention_policy("app", {"daily": 1})
+    path = write_backup(tmp_path / "nightly.dump", "monday")
+    engine.history.add_backup("2024-05-01 02:00:00", "app", "db1", path, 6)
+    write_backup(tmp_path / "nightly.dump", "tuesday")
+    engine.history.add_backup("2024-05-02 02:00:00", "app", "db1", path, 7)
+
+    assert [b["created"] for b in engine.history.backups("app")] == ["2024-05-02 02:00:00"]
+    result = engine.prune_backups("app")
+
+    assert result["deleted"] == []
+    assert (tmp_path / "nightly.dump").read_text(encoding="utf-8") == "tuesday"
+
+
+def test_prune_keeps_files_a_kept_row_references(engine, tmp_path):
+    """Test that duplicate catalog rows for one file never delete it."""
+    engine.set_retention_policy("app", {"daily": 1})
+    path = write_backup(tmp_path / "nightly.dump")
+    # Two live rows for one path, as catalogs from before add_backup replaced them hold
+    with engine.history.connection:
+        engine.history.connection.executemany(
+            "INSERT INTO backups (created, database, host, file_path, size) VALUES (?, ?, ?, ?, ?)",
+            [
+                ("2024-05-01 02:00:00", "app", "db1", path, 4),
+                ("2024-05-02 02:00:00", "app", "db1", path, 4),
+            ],
+        )
+
+    result = engine.prune_backups("app")
+
+    assert result["deleted"] == []
+    assert (tmp_path / "nightly.dump").exists()
+    assert [b["created"] for b in engine.history.backups("app")] == ["2024-05-02 02:00:00"]
+
+
+def test_prune_deletes_expired_backups(engine, tmp_path):
+    """Test that pruning deletes expired files and takes them out of the catalog."""
+    engine.set_retention_policy("app", {"daily": 1})
+    old = write_backup(tmp_path / "old.dump")
+    new = write_backup(tmp_path / "new.dump")
+    engine.history.add_backup("2024-05-01 02:00:00", "app", "db1", old, 4)
+    engine.history.add_backup("2024-05-02 02:00:00", "app", "db1", new, 4)
+
+    dry_run = engine.prune_backups("app", dry_run=True)
+    assert [b["file_path"] for b in dry_run["plans"][0]["expire"]] == [old]
+    assert (tmp_path / "old.dump").exists()
+
+    result = engine.prune_backups("app")
+    assert [b["file_path"] for b in result["deleted"]] == [old]
+    assert result["freed_bytes"] == 4
+    assert not (tmp_path / "old.dump").exists()
+    assert (tmp_path / "new.dump").exists()
+    assert [b["file_path"] for b in engine.history.backups("app")] == [new]
+
+
+def test_policies_are_planned_per_server(engine, tmp_path):
+    """Test that backups of same-named databases on two servers don't share buckets."""
+    engine.set_retention_policy("app", {"daily": 1})
+    first = write_backup(tmp_path / "a1.dump")
+    second = write_backup(tmp_path / "b1.dump")
+    engine.history.add_backup("2024-05-01 01:00:00", "app", "db-a", first, 4)
+    engine.history.add_backup("2024-05-01 02:00:00", "app", "db-b", second, 4)
+
+    plans = engine.plan_pruning("app")
+    assert [(plan["host"], len(plan["keep"]), len(plan["expire"])) for plan in plans] == [
+        ("db-a", 1, 0),
+        ("db-b", 1, 0),
+    ]
+
+    assert engine.prune_backups()["deleted"] == []
+    assert (tmp_path / "a1.dump").exists() and (tmp_path / "b1.dump").exists()
@@ -0,0 +1,252 @@
+"""Tests for cron parsing and the backup scheduler, driven by a fake clock"""
+
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from db_engine import BackupScheduler, CronExpression, DatabaseEngine
+
+SOURCE = "postgresql://backup@db1:5432/shop"
+
+
+class FakeClock:
+    """Naive local time that only moves when a test moves it"""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, **delta):
+        self.now += timedelta(**delta)
+
+
+class FakeQueue:
+    """Records submitted backups instead of running them"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, source_db, **options):
+        self.submitted.append(dict(options, source_db=source_db))
+        return len(self.submitted)
+
+
+class MaxRandom(random.Random):
+    """Always picks the top of the range"""
+
+    def randint(self, low, high):
+        return high
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = DatabaseEngine(str(tmp_path / "app_data"))
+    yield engine
+    engine.close()
+
+
+def make_scheduler(engine, clock, rng=None):
+    return BackupScheduler(engine, FakeQueue(), clock=clock, rng=rng or random.Random(1))
+
+
+def test_cron_fields_parse_lists_ranges_steps_and_names():
+    """Test the field syntax: lists, ranges, steps, names and aliases."""
+    cron = CronExpression("0,30 */6 1-7 jan,jul mon-fri")
+    assert cron.minutes == {0, 30}
+    assert cron.hours == {0, 6, 12, 18}
+    assert cron.days == set(range(1, 8))
+    assert cron.months == {1, 7}
+    assert cron.weekdays == {1, 2, 3, 4, 5}
+
+    assert CronExpression("5/15 * * * *").minutes == {5, 20, 35, 50}
+    assert CronExpression("* * * * 7").weekdays == {0}
+    assert CronExpression("* * * * sat-sun").weekdays == {6, 0}
+    assert CronExpression("* * * * mon-sun").weekdays == set(range(7))
+    assert CronExpression("* * * * 1-7/2").weekdays == {1, 3, 5, 0}
+    assert CronExpression("@daily").hours == {0}
+    assert CronExpression("@weekly").weekdays == {0}
+
+
+@pytest.mark.parametrize(
+    "expression",
+    ["* * * *", "60 * * * *", "* 24 * * *", "* * 0 * *", "* * * 13 *", "*/0 * * * *",
+     "5-1 * * * *", "* * * foo *"],
+)
+def test_cron_rejects_invalid_expressions(expression):
+    """Test that malformed fields raise ValueError."""
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_cron_day_fields_match_either_when_both_restricted():
+    """Test cron's rule that day-of-month and day-of-week are OR-ed."""
+    cron = CronExpression("0 3 1 * mon")
+    # 2024-05-01 is a Wednesday (the 1st), 2024-05-06 the next Monday
+    assert cron.next_after(datetime(2024, 4, 30, 12, 0)) == datetime(2024, 5, 1, 3, 0)
+    assert cron.next_after(datetime(2024, 5, 1, 3, 0)) == datetime(2024, 5, 6, 3, 0)
+
+
+def test_stepped_star_day_field_is_not_a_restriction():
+    """Test that "*/2" days with a weekday need both, like Vixie cron and cronie."""
+    cron = CronExpression("0 0 */2 * 1")
+    # Odd-day Mondays in 2024: 1 Jan, 15 Jan, 29 Jan, 5 Feb
+    runs = [datetime(2023, 12, 31)]
+    for _ in range(4):
+        runs.append(cron.next_after(runs[-1]))
+    assert runs[1:] == [
+        datetime(2024, 1, 1),
+        datetime(2024, 1, 15),
+        datetime(2024, 1, 29),
+        datetime(2024, 2, 5),
+    ]
+    # A stepped star weekday likewise leaves the day of month in charge
+    assert CronExpression("0 0 13 * */1").next_after(datetime(2024, 1, 1)) == (
+        datetime(2024, 1, 13)
+    )
+
+
+def test_next_run_skips_months_without_the_day():
+    """Test that the 31st only runs in months that have one."""
+    cron = CronExpression("0 3 31 * *")
+    assert cron.next_after(datetime(2024, 1, 31, 3, 0)) == datetime(2024, 3, 31, 3, 0)
+    assert cron.next_after(datetime(2024, 3, 31, 3, 0)) == datetime(2024, 5, 31, 3, 0)
+    assert cron.next_after(datetime(2024, 12, 31, 4, 0)) == datetime(2025, 1, 31, 3, 0)
+
+
+def test_next_run_finds_leap_days():
+    """Test that February 29th waits for the next leap year."""
+    cron = CronExpression("30 1 29 2 *")
+    assert cron.next_after(datetime(2025, 3, 1)) == datetime(2028, 2, 29, 1, 30)
+    with pytest.raises(ValueError):
+        CronExpression("0 0 30 2 *").next_after(datetime(2024, 1, 1))
+
+
+def test_next_run_is_strictly_after_and_rolls_over_midnight():
+    """Test that the current minute never counts and days roll over."""
+    cron = CronExpression("45 23 * * *")
+    assert cron.next_after(datetime(2024, 5, 1, 23, 45, 0)) == datetime(2024, 5, 2, 23, 45)
+    assert cron.next_after(datetime(2024, 12, 31, 23, 45, 30)) == datetime(2025, 1, 1, 23, 45)
+
+
+def test_jitter_stays_within_bounds(engine):
+    """Test that each planned run is delayed by 0 to jitter_minutes."""
+    clock = FakeClock(datetime(2024, 5, 1, 0, 0))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("nightly", SOURCE, "0 2 * * *", jitter_minutes=15)
+    for day in range(200):
+        entry = scheduler._plan(scheduler.schedules[0], clock() + timedelta(days=day))
+        delay = datetime.fromisoformat(entry["due"]) - datetime.fromisoformat(entry["slot"])
+        assert timedelta(0) <= delay <= timedelta(minutes=15)
+
+    top = make_scheduler(engine, clock, rng=MaxRandom())
+    entry = top.add_schedule("nightly", SOURCE, "0 2 * * *", jitter_minutes=15)
+    assert top.next_runs() == [("nightly", datetime(2024, 5, 1, 2, 15))]
+    assert entry["jitter_minutes"] == 15
+
+
+def test_run_pending_submits_only_when_due(engine):
+    """Test that a backup is queued once its time comes, then planned again."""
+    clock = FakeClock(datetime(2024, 5, 1, 1, 0))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("nightly", SOURCE, "0 2 * * *", parallel=True, jobs=4)
+
+    assert scheduler.run_pending() == []
+    assert scheduler.seconds_until_next() == 3600
+
+    clock.advance(hours=1)
+    assert len(scheduler.run_pending()) == 1
+    assert scheduler.queue.submitted == [
+        {"source_db": SOURCE, "parallel": True, "jobs": 4, "selection": None, "repository": None}
+    ]
+    assert scheduler.next_runs() == [("nightly", datetime(2024, 5, 2, 2, 0))]
+    assert scheduler.run_pending() == []
+
+
+def test_missed_runs_are_caught_up_once(engine):
+    """Test that a long outage leads to a single catch-up backup on startup."""
+    clock = FakeClock(datetime(2024, 5, 1, 1, 0))
+    make_scheduler(engine, clock).add_schedule("nightly", SOURCE, "0 2 * * *")
+
+    # The machine was off for three days; a new scheduler reads the index
+    clock.advance(days=3, hours=9)
+    scheduler = make_scheduler(engine, clock)
+    assert len(scheduler.run_pending()) == 1
+    assert scheduler.run_pending() == []
+    assert scheduler.next_runs() == [("nightly", datetime(2024, 5, 5, 2, 0))]
+
+
+def test_missed_runs_are_skipped_without_catch_up(engine):
+    """Test that catch_up off skips old runs but still runs late ones within the grace."""
+    clock = FakeClock(datetime(2024, 5, 1, 1, 0))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("nightly", SOURCE, "0 2 * * *", catch_up=False)
+
+    clock.now = datetime(2024, 5, 1, 2, 3)
+    assert len(scheduler.run_pending()) == 1
+
+    clock.now = datetime(2024, 5, 3, 9, 0)
+    assert scheduler.run_pending() == []
+    skipped = engine.history.query(operation="SCHEDULE")
+    assert len(skipped) == 1
+    assert "Skipped missed run of 'nightly' due 2024-05-02 02:00" in skipped[0]["status"]
+    assert scheduler.next_runs() == [("nightly", datetime(2024, 5, 4, 2, 0))]
+
+
+@pytest.fixture
+def london_time(monkeypatch):
+    """Local time with UK daylight saving: forward at 01:00, back at 02:00"""
+    if not hasattr(time, "tzset"):
+        pytest.skip("time.tzset is not available on this platform")
+    monkeypatch.setenv("TZ", "GMT0BST,M3.5.0/1,M10.5.0")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_run_in_spring_forward_gap_is_not_missed(engine, london_time):
+    """Test that a run due in the skipped hour still goes without catch-up."""
+    clock = FakeClock(datetime(2024, 3, 31, 0, 59))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("early", SOURCE, "30 1 * * *", catch_up=False)
+
+    # One minute later the clock reads 02:00; 01:30 never happened
+    clock.now = datetime(2024, 3, 31, 2, 0)
+    assert len(scheduler.run_pending()) == 1
+    assert engine.history.query(operation="SCHEDULE") == []
+    assert scheduler.next_runs() == [("early", datetime(2024, 4, 1, 1, 30))]
+
+
+def test_repeated_hour_at_fall_back_runs_once(engine, london_time):
+    """Test that the 01:00-02:00 hour happening twice doesn't repeat a run."""
+    clock = FakeClock(datetime(2024, 10, 27, 0, 0))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("late", SOURCE, "30 1 * * *")
+
+    clock.now = datetime(2024, 10, 27, 1, 30)
+    assert len(scheduler.run_pending()) == 1
+
+    # At 02:00 the clock goes back to 01:00 and passes 01:30 again
+    clock.now = datetime(2024, 10, 27, 1, 0)
+    for _ in range(60):
+        clock.advance(minutes=1)
+        assert scheduler.run_pending() == []
+    assert len(scheduler.queue.submitted) == 1
+    assert scheduler.next_runs() == [("late", datetime(2024, 10, 28, 1, 30))]
+
+
+def test_schedule_with_unknown_profile_is_skipped(engine):
+    """Test that a run whose profile has gone is skipped rather than dumping everything."""
+    engine.settings["backup_profiles"] = {"sales": {"table": ["sales.*"]}}
+    clock = FakeClock(datetime(2024, 5, 1, 1, 0))
+    scheduler = make_scheduler(engine, clock)
+    scheduler.add_schedule("nightly", SOURCE, "0 2 * * *", profile="sales")
+    del engine.settings["backup_profiles"]["sales"]
+
+    clock.advance(hours=1)
+    assert scheduler.run_pending() == []
+    assert "Skipped run of 'nightly'" in engine.history.query(operation="SCHEDULE")[0]["status"]
@@ -0,0 +1,163 @@
+"""Tests for selective backup patterns, which follow psql's and pg_dump's rules"""
+
+import pytest
+
+from db_engine import (
+    compile_schema_pattern,
+    compile_table_pattern,
+    normalize_selection,
+    pg_name_regex,
+    preview_selection,
+    selection_is_empty,
+    selection_pg_dump_args,
+    split_pg_pattern,
+)
+
+CENSUS = {
+    "table_sizes": {
+        "public.orders": 5000,
+        "public.order_lines": 20000,
+        "public.Customers": 300,
+        "audit.log_2023": 90000,
+        "audit.log_2024": 70000,
+        "sales.q1": 800,
+        "sales.a,b": 10,
+    },
+    "row_estimates": {"public.orders": 50, "public.order_lines": 400, "sales.q1": 8},
+    "large_objects": 3,
+    "large_object_bytes": 1024,
+}
+
+
+def matches(pattern, name):
+    return bool(pg_name_regex(pattern).match(name))
+
+
+def test_split_pg_pattern_ignores_quoted_separators():
+    """Test that dots (or other separators) inside double quotes don't split."""
+    assert split_pg_pattern("public.orders") == ["public", "orders"]
+    assert split_pg_pattern('"my.schema".orders') == ['"my.schema"', "orders"]
+    assert split_pg_pattern("db.public.orders") == ["db", "public", "orders"]
+    assert split_pg_pattern("orders") == ["orders"]
+    assert split_pg_pattern('a,"b,c"\nd', "\n,") == ["a", '"b,c"', "d"]
+
+
+@pytest.mark.parametrize(
+    "pattern, name, expected",
+    [
+        ("orders", "orders", True),
+        ("orders", "orders_old", False),
+        ("ORDERS", "orders", True),
+        ('"ORDERS"', "orders", False),
+        ('"Customers"', "Customers", True),
+        ("Customers", "Customers", False),
+        ("order*", "order_lines", True),
+        ("*lines", "order_lines", True),
+        ("log_202?", "log_2024", True),
+        ("log_202?", "log_20245", False),
+        ('"a*b"', "a*b", True),
+        ('"a*b"', "axb", False),
+        ('"say ""hi"""', 'say "hi"', True),
+        ("price$", "price$", True),
+        ("log_20[0-9]+", "log_2023", True),
+        ("log_20[0-9]+", "log_20x", False),
+    ],
+)
+def test_pg_name_regex_follows_psql(pattern, name, expected):
+    """Test wildcards, case folding, quoting and regex pass-through like psql."""
+    assert matches(pattern, name) is expected
+
+
+@pytest.mark.parametrize("pattern", ['"orders', "log_[0-9"])
+def test_pg_name_regex_rejects_bad_patterns(pattern):
+    """Test that an unterminated quote or broken regex is a ValueError."""
+    with pytest.raises(ValueError):
+        pg_name_regex(pattern)
+
+
+def test_compile_patterns_by_dotted_parts():
+    """Test the schema/table split, the ignored database part and too many dots."""
+    schema_re, table_re = compile_table_pattern("db.audit.log_*")
+    assert schema_re.match("audit") and table_re.match("log_2024")
+    assert compile_table_pattern("orders")[0] is None
+    with pytest.raises(ValueError, match="Too many dotted names"):
+        compile_table_pattern("a.b.c.d")
+    assert compile_schema_pattern("db.audit").match("audit")
+    with pytest.raises(ValueError, match="Too many dotted names"):
+        compile_schema_pattern("a.b.c")
+
+
+def test_normalize_selection_splits_text_on_unquoted_commas_and_lines():
+    """Test that a quoted name with a comma survives being typed as text."""
+    selection = normalize_selection(
+        {
+            "include_tables": 'sales."a,b", public.orders\n\n  audit.* ',
+            "exclude_schemas": ["", " tmp "],
+        }
+    )
+    assert selection["include_tables"] == ['sales."a,b"', "public.orders", "audit.*"]
+    assert selection["exclude_schemas"] == ["tmp"]
+    assert selection["include_schemas"] == []
+    with pytest.raises(ValueError, match="Unterminated quote"):
+        normalize_selection({"exclude_tables": 'public."orders'})
+    assert selection_is_empty(normalize_selection(None))
+    assert not selection_is_empty(selection)
+
+
+def test_pg_dump_args_use_the_equals_form():
+    """Test that patterns reach pg_dump as --option=pattern, in rule order."""
+    selection = normalize_selection(
+        {"exclude_table_data": "audit.*", "include_schemas": "-odd, public"}
+    )
+    assert selection_pg_dump_args(selection) == [
+        "--schema=-odd",
+        "--schema=public",
+        "--exclude-table-data=audit.*",
+    ]
+    assert selection_pg_dump_args(None) == []
+
+
+def test_preview_excludes_data_and_schemas():
+    """Test -N and --exclude-table-data, with the sizes they save."""
+    preview = preview_selection(
+        CENSUS, {"exclude_schemas": "sales", "exclude_table_data": "audit.log_*"}
+    )
+    assert sorted(preview["full"]) == [
+        "public.Customers",
+        "public.order_lines",
+        "public.orders",
+    ]
+    assert sorted(preview["schema_only"]) == ["audit.log_2023", "audit.log_2024"]
+    assert sorted(preview["excluded"]) == ["sales.a,b", "sales.q1"]
+    assert preview["bytes"] == {"full": 25300, "schema_only": 160000, "excluded": 810}
+
+    census = preview["census"]
+    assert set(census["table_sizes"]) == set(preview["full"])
+    assert census["schemas"] == {"public": {"bytes": 25300, "tables": 3, "rows": 450}}
+    # Excluding keeps the large objects; only an include list drops them
+    assert census["large_objects"] == 3
+    assert CENSUS["large_objects"] == 3 and len(CENSUS["table_sizes"]) == 7
+
+
+def test_preview_table_patterns_override_schemas():
+    """Test that -t wins over -n, -T always excludes, and bare names mean public."""
+    preview = preview_selection(
+        CENSUS,
+        {
+            "include_schemas": "audit",
+            "include_tables": 'order*, sales."a,b", "Customers"',
+            "exclude_tables": "public.order_lines",
+        },
+    )
+    assert sorted(preview["full"]) == ["public.Customers", "public.orders", "sales.a,b"]
+    assert "audit.log_2024" in preview["excluded"]
+    assert preview["census"]["large_objects"] == 0
+    assert preview["census"]["large_object_bytes"] == 0
+
+
+def test_preview_of_an_empty_selection_dumps_everything():
+    """Test that no rules means every table in full."""
+    preview = preview_selection(CENSUS, {})
+    assert len(preview["full"]) == 7
+    assert preview["bytes"]["full"] == sum(CENSUS["table_sizes"].values())
+    assert preview["census"]["large_objects"] == 3